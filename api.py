@@ -3,10 +3,16 @@ FastAPI Backend for USIU-Africa Student Support Chatbot
 Multi-agent system integration with free LLM support
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import json
+import time
 import sys
 import os
 from pathlib import Path
@@ -15,7 +21,7 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from src.agents.multi_agent_system import SupervisorAgent
+from src.agents.multi_agent_system import SupervisorAgent, SessionStore, HistoryStore, ResponseCache, FeedbackLog
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -33,9 +39,211 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Worker pool for the CPU-bound route -> retrieve -> generate pipeline, so the
+# event loop stays free to accept connections while queries are processed
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+executor = ThreadPoolExecutor(max_workers=CHAT_WORKERS, thread_name_prefix="chat")
+
+# Threads answering the parts of compound questions, 0 answers them as one query,
+# and the keyword hits a category needs before it counts as a separate part
+MULTI_INTENT_WORKERS = int(os.getenv("MULTI_INTENT_WORKERS", "4"))
+MULTI_INTENT_MIN_SCORE = int(os.getenv("MULTI_INTENT_MIN_SCORE", "1"))
+
+# Admission control for the chat endpoints: queries running at once (0 disables),
+# queries allowed to wait for a slot, and how long they may wait before a 503
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", str(CHAT_WORKERS)))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "64"))
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "5"))
+CHAT_RETRY_AFTER_SECONDS = int(os.getenv("CHAT_RETRY_AFTER_SECONDS", "1"))
+
+
+class AdmissionController:
+    """Bounds concurrent chat queries and the queue waiting for a slot
+    
+    Requests beyond the queue, or that wait longer than the timeout, are shed
+    with 503 and a Retry-After header instead of piling up on the executor.
+    """
+    
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._semaphore = None
+        self._loop = None
+    
+    def _slots(self) -> asyncio.Semaphore:
+        """Semaphore of the running event loop; a new loop (tests, benchmarks) gets a fresh one"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrent))
+            self.active = 0
+        return self._semaphore
+    
+    def _overloaded(self, reason: str) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=f"Server is busy ({reason}); please retry shortly",
+            headers={"Retry-After": str(self.retry_after)}
+        )
+    
+    async def acquire(self):
+        """Take a slot, waiting in the bounded queue if needed; raises 503 when shedding"""
+        if self.max_concurrent <= 0:
+            self.admitted += 1
+            return
+        semaphore = self._slots()
+        if semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise self._overloaded("queue full")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise self._overloaded("queue timeout")
+            finally:
+                self.waiting -= 1
+        else:
+            await semaphore.acquire()
+        self.active += 1
+        self.admitted += 1
+    
+    def release(self):
+        if self.max_concurrent <= 0:
+            return
+        self.active -= 1
+        self._semaphore.release()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out
+        }
+    
+    def gauges(self) -> List[tuple]:
+        """Admission state in the (name, type, help, value) form /metrics renders"""
+        return [
+            ("usiu_admission_active", "gauge", "Chat queries currently running", self.active),
+            ("usiu_admission_queue_depth", "gauge", "Chat queries waiting for a slot", self.waiting),
+            ("usiu_admission_admitted_total", "counter", "Chat queries admitted", self.admitted),
+            ("usiu_admission_rejected_total", "counter", "Chat queries shed because the queue was full",
+             self.rejected),
+            ("usiu_admission_timeouts_total", "counter", "Chat queries shed after waiting too long",
+             self.timed_out)
+        ]
+
+
+admission = AdmissionController(
+    CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT_SECONDS, CHAT_RETRY_AFTER_SECONDS
+)
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Streaming response that gives its admission slot back however it ends
+    
+    The slot is released when the response has been sent, failed or was
+    abandoned, including when the body iterator never started.
+    """
+    
+    def __init__(self, content, controller: AdmissionController, **kwargs):
+        super().__init__(content, **kwargs)
+        self.controller = controller
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            self.controller.release()
+
+
+# Per-conversation history limits
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "20"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MEMORY_MB = float(os.getenv("SESSION_MEMORY_MB", "64"))
+
+# Durable history shared by all workers; empty keeps history in this worker's memory
+HISTORY_DB = os.getenv("HISTORY_DB", "data/history.db")
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "0.5"))
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "100"))
+
+# Answers to repeated questions, 0 disables the cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+
+# Largest number of questions accepted by /chat/batch
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1000"))
+
+# Output of `python build_knowledge.py embeddings`; dense retrieval is skipped if absent
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "knowledge_index")
+
+# Output of `python build_knowledge.py snapshot`; raw JSON is parsed if absent or stale
+KNOWLEDGE_SNAPSHOT = os.getenv("KNOWLEDGE_SNAPSHOT", "knowledge_index/knowledge.snapshot")
+
+# Load each knowledge file on first use by its category instead of at startup
+KNOWLEDGE_LAZY = os.getenv("KNOWLEDGE_LAZY", "false").lower() in ("1", "true", "yes")
+
+# Cap on parsed knowledge held in memory (least recently used files are evicted), 0 disables
+KNOWLEDGE_MEMORY_MB = float(os.getenv("KNOWLEDGE_MEMORY_MB", "0"))
+
+# Store parsed knowledge as interned, tuple-backed read-only records to save memory
+KNOWLEDGE_COMPACT = os.getenv("KNOWLEDGE_COMPACT", "false").lower() in ("1", "true", "yes")
+
+# Seconds between knowledge directory polls, 0 disables hot reload
+KNOWLEDGE_WATCH_INTERVAL = float(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "5"))
+
+# Feedback is appended here in batches of FEEDBACK_BATCH_SIZE or every FEEDBACK_FLUSH_SECONDS
+FEEDBACK_LOG = os.getenv("FEEDBACK_LOG", "data/feedback.jsonl")
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "100"))
+FEEDBACK_FLUSH_SECONDS = float(os.getenv("FEEDBACK_FLUSH_SECONDS", "1"))
+feedback_log = FeedbackLog(FEEDBACK_LOG, batch_size=FEEDBACK_BATCH_SIZE, interval=FEEDBACK_FLUSH_SECONDS)
+
+# Required in the X-Admin-Token header of admin endpoints when set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # Initialize supervisor agent
 try:
-    supervisor = SupervisorAgent(knowledge_dir="knowledge")
+    if HISTORY_DB:
+        sessions = HistoryStore(
+            HISTORY_DB,
+            batch_size=HISTORY_BATCH_SIZE,
+            interval=HISTORY_FLUSH_SECONDS,
+            retention=HISTORY_RETENTION_DAYS * 86400
+        )
+    else:
+        sessions = SessionStore(
+            max_turns=SESSION_MAX_TURNS,
+            ttl=SESSION_TTL_SECONDS,
+            max_sessions=SESSION_MAX_COUNT,
+            memory_budget=int(SESSION_MEMORY_MB * 1024 * 1024)
+        )
+    supervisor = SupervisorAgent(
+        knowledge_dir="knowledge",
+        sessions=sessions,
+        cache=ResponseCache(max_size=RESPONSE_CACHE_SIZE),
+        embeddings_dir=EMBEDDINGS_DIR,
+        snapshot_path=KNOWLEDGE_SNAPSHOT,
+        lazy=KNOWLEDGE_LAZY,
+        memory_limit=int(KNOWLEDGE_MEMORY_MB * 1024 * 1024) or None,
+        compact=KNOWLEDGE_COMPACT,
+        fanout_workers=MULTI_INTENT_WORKERS,
+        multi_intent_min_score=MULTI_INTENT_MIN_SCORE
+    )
     print("✅ Supervisor agent initialized successfully")
 except Exception as e:
     print(f"❌ Error initializing supervisor: {e}")
@@ -54,6 +262,28 @@ class QueryResponse(BaseModel):
     category: str
     sources: List[str]
     confidence: str = "high"
+    parts: Optional[List[Dict[str, Any]]] = None
+
+
+class FeedbackRequest(BaseModel):
+    """Rating of one answer"""
+    rating: str
+    question: Optional[str] = None
+    answer: Optional[str] = None
+    category: Optional[str] = None
+    conversation_id: Optional[str] = None
+    comment: Optional[str] = None
+
+
+class BatchQueryRequest(BaseModel):
+    """Request model for batch chat queries"""
+    questions: List[str]
+    conversation_id: Optional[str] = None
+
+
+class BatchQueryResponse(BaseModel):
+    """Response model for batch chat queries, in request order"""
+    results: List[QueryResponse]
 
 
 @app.get("/")
@@ -74,12 +304,36 @@ def health_check():
         "status": "healthy",
         "supervisor_initialized": supervisor is not None,
         "knowledge_base_loaded": supervisor is not None and len(supervisor.retriever.cache) > 0,
-        "available_knowledge_files": list(supervisor.retriever.cache.keys()) if supervisor else []
+        "knowledge_version": supervisor.retriever.version if supervisor else None,
+        "available_knowledge_files": list(supervisor.retriever.cache.keys()) if supervisor else [],
+        "response_cache": supervisor.cache.stats() if supervisor else {},
+        "admission": admission.stats(),
+        "feedback": feedback_log.stats()
     }
 
 
+@app.on_event("startup")
+def start_knowledge_watcher():
+    """Start hot reload in each worker; threads do not survive serve.py's fork"""
+    if supervisor is not None and KNOWLEDGE_WATCH_INTERVAL > 0:
+        supervisor.retriever.start_watching(KNOWLEDGE_WATCH_INTERVAL)
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    """Let in-flight queries finish and buffered feedback and history reach disk before the worker exits"""
+    if supervisor is not None:
+        supervisor.retriever.stop_watching()
+    executor.shutdown(wait=True)
+    if supervisor is not None and supervisor.fanout is not None:
+        supervisor.fanout.shutdown(wait=True)
+    feedback_log.close()
+    if supervisor is not None and isinstance(supervisor.sessions, HistoryStore):
+        supervisor.sessions.close()
+
+
 @app.post("/chat", response_model=QueryResponse)
-def chat(request: QueryRequest):
+async def chat(request: QueryRequest):
     """
     Main chat endpoint - processes user queries through multi-agent system
     """
@@ -96,14 +350,22 @@ def chat(request: QueryRequest):
                 detail="Question cannot be empty"
             )
         
-        # Process query through multi-agent system
-        result = supervisor.process_query(request.question)
+        # Process query through multi-agent system off the event loop
+        await admission.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                executor, supervisor.process_query, request.question, request.conversation_id
+            )
+        finally:
+            admission.release()
         
         return QueryResponse(
             answer=result["response"],
             category=result["category"],
             sources=result["sources"],
-            confidence="high"
+            confidence="high",
+            parts=result.get("parts")
         )
     
     except HTTPException:
@@ -116,27 +378,179 @@ def chat(request: QueryRequest):
         )
 
 
-@app.get("/history")
-def get_history():
-    """Get conversation history"""
+@app.post("/chat/stream")
+async def chat_stream(request: QueryRequest):
+    """
+    Streaming chat endpoint - sends the category and sources first, then the
+    answer in chunks, as server-sent events
+    """
     if supervisor is None:
-        return {"history": []}
+        raise HTTPException(
+            status_code=500,
+            detail="Supervisor agent not initialized"
+        )
+    
+    if not request.question or request.question.strip() == "":
+        raise HTTPException(
+            status_code=400,
+            detail="Question cannot be empty"
+        )
+    
+    # The slot is held until the stream ends, so shedding happens before the 200
+    await admission.acquire()
+    events = supervisor.stream_query(request.question, request.conversation_id)
+    
+    async def event_source():
+        # Each step of the pipeline runs on the executor, never on the event loop
+        step = None
+        try:
+            while True:
+                step = executor.submit(next, events, None)
+                event = await asyncio.wrap_future(step)
+                if event is None:
+                    break
+                name = event.pop("event")
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"Error streaming query: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            # After a disconnect the current step may still be running; close the generator once it returns
+            if step is None:
+                events.close()
+            else:
+                step.add_done_callback(lambda _: events.close())
     
+    return AdmittedStreamingResponse(
+        event_source(),
+        admission,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/chat/batch", response_model=BatchQueryResponse)
+async def chat_batch(request: BatchQueryRequest):
+    """
+    Batch chat endpoint - answers many questions in one round trip
+    """
+    try:
+        if supervisor is None:
+            raise HTTPException(
+                status_code=500,
+                detail="Supervisor agent not initialized"
+            )
+        
+        if len(request.questions) > BATCH_MAX_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {BATCH_MAX_SIZE} questions per batch"
+            )
+        
+        empty = [i for i, question in enumerate(request.questions) if not question or question.strip() == ""]
+        if empty:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Questions cannot be empty (indexes {empty})"
+            )
+        
+        await admission.acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(
+                executor, supervisor.process_batch, request.questions, request.conversation_id
+            )
+        finally:
+            admission.release()
+        
+        return BatchQueryResponse(results=[
+            QueryResponse(
+                answer=result["response"],
+                category=result["category"],
+                sources=result["sources"],
+                confidence="high",
+                parts=result.get("parts")
+            )
+            for result in results
+        ])
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error processing batch: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing batch: {str(e)}"
+        )
+
+
+@app.get("/history")
+def get_history(conversation_id: Optional[str] = None, limit: int = 10, before: Optional[int] = None):
+    """Get one page of the caller's conversation history, oldest turn first
+    
+    Pass the returned next_cursor as ``before`` to fetch the preceding page.
+    """
+    if supervisor is None or not conversation_id:
+        return {"history": [], "next_cursor": None}
+    if limit < 1 or limit > HISTORY_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_PAGE_MAX}")
+    
+    history, next_cursor = supervisor.get_history_page(conversation_id, limit, before)
     return {
-        "history": supervisor.conversation_history[-10:]  # Last 10 conversations
+        "history": history,
+        "next_cursor": next_cursor
     }
 
 
 @app.post("/feedback")
-def submit_feedback(feedback: Dict[str, Any]):
-    """Submit feedback on responses"""
-    # In production, this would store feedback for improvement
+async def submit_feedback(feedback: FeedbackRequest):
+    """Submit feedback on responses; it is buffered and written to disk in batches"""
+    if feedback.rating not in ("up", "down"):
+        raise HTTPException(status_code=400, detail="Rating must be 'up' or 'down'")
+    
+    record = feedback.model_dump()
+    record["timestamp"] = time.time()
+    record["knowledge_version"] = supervisor.retriever.version if supervisor else None
+    feedback_log.submit(record)
     return {
         "status": "received",
         "message": "Thank you for your feedback!"
     }
 
 
+@app.post("/admin/reload-knowledge")
+def reload_knowledge(x_admin_token: Optional[str] = Header(None)):
+    """Re-read changed knowledge files and swap them in without a restart"""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    
+    if supervisor is None:
+        raise HTTPException(status_code=500, detail="Supervisor agent not initialized")
+    
+    result = supervisor.retriever.reload()
+    return {
+        "status": "reloaded" if result["changed"] else "unchanged",
+        "knowledge_version": result["version"],
+        "changed_files": result["changed"],
+        "failed_files": result["failed"]
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics: per-stage latency, routing counters, cache and session gauges"""
+    if supervisor is None:
+        return PlainTextResponse("", media_type="text/plain; version=0.0.4")
+    feedback_stats = feedback_log.stats()
+    gauges = admission.gauges() + [
+        ("usiu_feedback_pending", "gauge", "Feedback records waiting to be written", feedback_stats["pending"]),
+        ("usiu_feedback_written_total", "counter", "Feedback records written to disk", feedback_stats["written"]),
+        ("usiu_feedback_dropped_total", "counter", "Feedback records dropped because the buffer was full",
+         feedback_stats["dropped"])
+    ]
+    return PlainTextResponse(supervisor.metrics_text(gauges), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/categories")
 def get_categories():
     """Get available query categories"""
@@ -154,15 +568,31 @@ def knowledge_stats():
     if supervisor is None or supervisor.retriever is None:
         return {"stats": {}}
     
+    retriever = supervisor.retriever
+    memory = retriever.memory_stats()
     stats = {}
-    for filename, data in supervisor.retriever.cache.items():
-        if isinstance(data, dict):
+    for filename, data in retriever.cache.items():
+        if isinstance(data, Mapping):
             stats[filename] = {
                 "loaded": True,
-                "top_level_keys": list(data.keys())[:5]
+                "top_level_keys": list(data.keys())[:5],
+                "resident_bytes": memory["files"].get(filename, 0)
             }
     
-    return {"stats": stats}
+    # Files not loaded yet (lazy mode) or evicted under the memory limit
+    for filename in retriever.JSON_FILES:
+        if filename not in stats:
+            stats[filename] = {"loaded": False, "top_level_keys": [], "resident_bytes": 0}
+    
+    return {
+        "stats": stats,
+        "memory": {
+            "lazy": memory["lazy"],
+            "compact": memory["compact"],
+            "memory_limit": memory["memory_limit"],
+            "resident_bytes": memory["resident_bytes"]
+        }
+    }
 
 
 if __name__ == "__main__":
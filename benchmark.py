@@ -0,0 +1,254 @@
+"""
+Benchmark Suite - Measure the USIU Chatbot agent pipeline and HTTP API
+Non-interactive; writes JSON results that can be compared across commits
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import SupervisorAgent
+
+# Same questions the demo and the Streamlit sidebar use, plus a few that
+# exercise the fee index and the general fallback
+QUERIES = [
+    "What are the fees for nursing?",
+    "How do I pay via M-Pesa?",
+    "What is the minimum GPA required?",
+    "Where is the library?",
+    "What are the library hours?",
+    "Tell me about scholarships",
+    "What are the rules about alcohol?",
+    "How do I contact the finance office?",
+    "How much is the MBA tuition?",
+    "What are the fees for international relations?",
+    "Tell me about counseling services",
+    "What happens if I violate the conduct policy?"
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Throughput and latency percentiles (microseconds) for a list of timings in seconds"""
+    ordered = sorted(latencies)
+    return {
+        "ops": len(ordered),
+        "ops_per_sec": round(len(ordered) / elapsed, 1) if elapsed > 0 else 0.0,
+        "mean_us": round(sum(ordered) / len(ordered) * 1e6, 2) if ordered else 0.0,
+        "p50_us": round(percentile(ordered, 0.50) * 1e6, 2),
+        "p95_us": round(percentile(ordered, 0.95) * 1e6, 2),
+        "p99_us": round(percentile(ordered, 0.99) * 1e6, 2)
+    }
+
+
+def time_calls(func: Callable[[str], Any], queries: List[str], iterations: int, warmup: int = 2) -> Dict[str, float]:
+    """Call func on every query `iterations` times and summarize per-call latency"""
+    for _ in range(warmup):
+        for query in queries:
+            func(query)
+    
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for query in queries:
+            begin = time.perf_counter()
+            func(query)
+            latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_microbenchmarks(supervisor: SupervisorAgent, iterations: int) -> Dict[str, Dict[str, float]]:
+    """Time each agent on its own and the full pipeline"""
+    router = supervisor.router
+    retriever = supervisor.retriever
+    generator = supervisor.generator
+    
+    routed = {query: router.route(query) for query in QUERIES}
+    retrieved = {query: retriever.retrieve(routed[query], query) for query in QUERIES}
+    
+    results = {
+        "router.route": time_calls(router.route, QUERIES, iterations),
+        "retriever.retrieve": time_calls(lambda q: retriever.retrieve(routed[q], q), QUERIES, iterations),
+        "generator.generate": time_calls(lambda q: generator.generate(q, retrieved[q], routed[q]), QUERIES, iterations)
+    }
+    
+    # The full pipeline with and without the response cache
+    cache_size = supervisor.cache.max_size
+    supervisor.cache.max_size = 0
+    supervisor.cache._entries.clear()
+    results["supervisor.process_query (uncached)"] = time_calls(supervisor.process_query, QUERIES, iterations)
+    supervisor.cache.max_size = cache_size
+    results["supervisor.process_query (cached)"] = time_calls(supervisor.process_query, QUERIES, iterations)
+    return results
+
+
+async def asgi_request(app, method: str, path: str, payload: Dict[str, Any]) -> int:
+    """Send one HTTP request straight to an ASGI app and return the status code"""
+    body = json.dumps(payload).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000)
+    }
+    received = False
+    status = 0
+    
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+    
+    await app(scope, receive, send)
+    return status
+
+
+async def run_load(app, path: str, requests_total: int, concurrency: int) -> Dict[str, Any]:
+    """Drive an ASGI app with `concurrency` concurrent clients and summarize latency"""
+    latencies = []
+    errors = 0
+    counter = iter(range(requests_total))
+    
+    async def client():
+        nonlocal errors
+        for i in counter:
+            query = QUERIES[i % len(QUERIES)]
+            begin = time.perf_counter()
+            status = await asgi_request(app, "POST", path, {"question": query})
+            latencies.append(time.perf_counter() - begin)
+            if status != 200:
+                errors += 1
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    summary = summarize(latencies, time.perf_counter() - start)
+    summary["concurrency"] = concurrency
+    summary["errors"] = errors
+    return summary
+
+
+def run_http_benchmarks(requests_total: int, concurrency_levels: List[int], cache: bool) -> Dict[str, Any]:
+    """Load-test /chat in process through the FastAPI app"""
+    from backend.api import app, supervisor
+    
+    if supervisor is None:
+        raise RuntimeError("Supervisor agent failed to initialize")
+    if not cache:
+        supervisor.cache.max_size = 0
+        supervisor.cache._entries.clear()
+    
+    results = {}
+    for concurrency in concurrency_levels:
+        results[f"POST /chat c={concurrency}"] = asyncio.run(run_load(app, "/chat", requests_total, concurrency))
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """List benchmarks whose p50 latency regressed by more than `tolerance`"""
+    regressions = []
+    for section in ("micro", "http"):
+        for name, result in current.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous or not previous.get("p50_us"):
+                continue
+            change = (result["p50_us"] - previous["p50_us"]) / previous["p50_us"]
+            if change > tolerance:
+                regressions.append(f"{name}: p50 {previous['p50_us']}us -> {result['p50_us']}us (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the USIU chatbot pipeline and API")
+    parser.add_argument("--knowledge-dir", default="knowledge")
+    parser.add_argument("--iterations", type=int, default=200, help="Passes over the query set per microbenchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per HTTP load level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--no-http", action="store_true", help="Skip the in-process API load test")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache for the API load test")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Allowed p50 slowdown before failing")
+    args = parser.parse_args()
+    
+    print("📋 Initializing Multi-Agent System...")
+    supervisor = SupervisorAgent(knowledge_dir=args.knowledge_dir)
+    
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "knowledge_files": len(supervisor.retriever.cache)
+        },
+        "micro": run_microbenchmarks(supervisor, args.iterations)
+    }
+    if not args.no_http:
+        results["http"] = run_http_benchmarks(args.requests, args.concurrency, cache=not args.no_cache)
+    
+    for section in ("micro", "http"):
+        for name, result in results.get(section, {}).items():
+            print(f"  {name:<40} {result['ops_per_sec']:>10} ops/s  "
+                  f"p50 {result['p50_us']:>9}us  p95 {result['p95_us']:>9}us  p99 {result['p99_us']:>9}us")
+    
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
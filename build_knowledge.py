@@ -0,0 +1,102 @@
+"""
+Offline build steps for the knowledge base
+Run once after editing knowledge files; API workers load the results at startup
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import (
+    KnowledgeRetrieverAgent,
+    KnowledgeSnapshot,
+    compact_json,
+    deep_sizeof,
+    DenseIndex,
+    HashingEncoder,
+    SentenceTransformerEncoder
+)
+
+
+def build_embeddings(args):
+    """Encode every knowledge chunk and write the memory-mappable matrix"""
+    retriever = KnowledgeRetrieverAgent(knowledge_dir=args.knowledge_dir)
+    if args.encoder == "hashing":
+        encoder = HashingEncoder(args.dim)
+    else:
+        encoder = SentenceTransformerEncoder(args.model)
+    
+    start = time.perf_counter()
+    dense = DenseIndex.build(retriever.index, encoder, args.output_dir)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Encoded {dense.matrix.shape[0]} chunks ({dense.matrix.shape[1]} dims) in {elapsed:.1f}s")
+    print(f"   → {args.output_dir}/{DenseIndex.MATRIX_FILE}")
+
+
+def build_snapshot(args):
+    """Parse and index the knowledge files into one compiled snapshot"""
+    start = time.perf_counter()
+    sources = KnowledgeSnapshot.source_manifest(args.knowledge_dir, KnowledgeRetrieverAgent.JSON_FILES)
+    retriever = KnowledgeRetrieverAgent(knowledge_dir=args.knowledge_dir, compact=args.compact)
+    output = os.path.join(args.output_dir, KnowledgeSnapshot.SNAPSHOT_FILE)
+    retriever.snapshot.save(output, sources)
+    elapsed = time.perf_counter() - start
+    print(f"✅ Compiled {len(sources)} knowledge files ({len(retriever.index.paths)} chunks) in {elapsed:.2f}s")
+    print(f"   → {output} ({os.path.getsize(output) / 1024:.0f} KB)")
+
+
+def measure_memory(args):
+    """Compare the resident size of each file as plain JSON and in compact form"""
+    shapes = {}
+    total_raw = total_compact = 0
+    print(f"{'File':<40} {'JSON':>10} {'Compact':>10} {'Saved':>10}")
+    for filename in KnowledgeRetrieverAgent.JSON_FILES:
+        filepath = os.path.join(args.knowledge_dir, filename)
+        if not os.path.exists(filepath):
+            continue
+        with open(filepath) as f:
+            data = json.load(f)
+        raw = deep_sizeof(data)
+        compact = deep_sizeof(compact_json(data, shapes))
+        total_raw += raw
+        total_compact += compact
+        print(f"{filename:<40} {raw:>10,} {compact:>10,} {1 - compact / raw:>9.0%}")
+    if total_raw:
+        print(f"{'Total':<40} {total_raw:>10,} {total_compact:>10,} {1 - total_compact / total_raw:>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build derived knowledge artifacts")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    
+    embeddings = subcommands.add_parser("embeddings", help="Build the dense chunk embeddings")
+    embeddings.add_argument("--knowledge-dir", default="knowledge")
+    embeddings.add_argument("--output-dir", default="knowledge_index")
+    embeddings.add_argument("--encoder", choices=["sentence-transformers", "hashing"], default="sentence-transformers")
+    embeddings.add_argument("--model", default="all-MiniLM-L6-v2")
+    embeddings.add_argument("--dim", type=int, default=384, help="Vector size for the hashing encoder")
+    embeddings.set_defaults(func=build_embeddings)
+    
+    snapshot = subcommands.add_parser("snapshot", help="Compile parsed knowledge and indexes for fast startup")
+    snapshot.add_argument("--knowledge-dir", default="knowledge")
+    snapshot.add_argument("--output-dir", default="knowledge_index")
+    snapshot.add_argument("--compact", action="store_true", help="Store knowledge as compact read-only records")
+    snapshot.set_defaults(func=build_snapshot)
+    
+    memory = subcommands.add_parser("memory", help="Report bytes saved per file by the compact representation")
+    memory.add_argument("--knowledge-dir", default="knowledge")
+    memory.set_defaults(func=measure_memory)
+    
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
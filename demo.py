@@ -122,10 +122,12 @@ def test_agents():
     print("\n2️⃣ Testing Knowledge Retriever Agent")
     retriever = KnowledgeRetrieverAgent(knowledge_dir="knowledge")
     results = retriever.retrieve("fees_financial", "nursing fees")
-    print(f"  ✅ Retrieved {len(results)} relevant knowledge files")
+    print(f"  ✅ Retrieved {len(results)} relevant knowledge passages")
+    for path in list(results.keys())[:3]:
+        print(f"     → {path}")
     
     print("\n3️⃣ Testing Response Generator Agent")
-    generator = ResponseGeneratorAgent()
+    generator = ResponseGeneratorAgent(retriever=retriever)
     response = generator.generate(
         "What are the fees for nursing?",
         results,
@@ -3,15 +3,208 @@ Multi-Agent System for USIU-Africa Student Support
 Specialized agents for different query types
 """
 
+import bisect
+import functools
+import hashlib
+import heapq
 import json
+import math
 import os
-from typing import Dict, List, Any
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Any, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Dense retrieval is optional
+    np = None
+
+class KeywordMatcher:
+    """Aho-Corasick automaton that scores keyword groups in one pass over a text
+    
+    Matches are word-boundary aware: a keyword must start at a word boundary and
+    end at one, optionally followed by a simple inflection ("fee" -> "fees"), so
+    "ai" no longer matches inside "said" nor "pay" inside "repay".
+    """
+    
+    SUFFIXES = ("s", "es", "ing", "ed")
+    
+    def __init__(self, groups: Dict[str, List[str]]):
+        self.groups = list(groups.keys())
+        self.keywords = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        
+        keyword_ids = {}
+        self._keyword_groups = []
+        for group_index, group in enumerate(self.groups):
+            for keyword in groups[group]:
+                keyword = keyword.lower()
+                if keyword not in keyword_ids:
+                    keyword_ids[keyword] = len(self.keywords)
+                    self.keywords.append(keyword)
+                    self._keyword_groups.append([])
+                    self._add(keyword, keyword_ids[keyword])
+                if group_index not in self._keyword_groups[keyword_ids[keyword]]:
+                    self._keyword_groups[keyword_ids[keyword]].append(group_index)
+        self._build_failure_links()
+    
+    def _add(self, keyword: str, keyword_id: int):
+        """Insert a keyword into the trie"""
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(keyword_id)
+    
+    def _build_failure_links(self):
+        """Breadth-first construction of failure links and merged outputs"""
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+    
+    def _ends_word(self, text: str, end: int) -> bool:
+        """True if a match ending at `end` is followed by a boundary or inflection"""
+        if end >= len(text) or not text[end].isalnum():
+            return True
+        for suffix in self.SUFFIXES:
+            tail = end + len(suffix)
+            if text.startswith(suffix, end) and (tail >= len(text) or not text[tail].isalnum()):
+                return True
+        return False
+    
+    def _scan(self, text: str) -> set:
+        """Ids of the distinct keywords found in already-lowercased text"""
+        found = set()
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword_id in self._output[state]:
+                if keyword_id in found:
+                    continue
+                start = index + 1 - len(self.keywords[keyword_id])
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if self._ends_word(text, index + 1):
+                    found.add(keyword_id)
+        return found
+    
+    def find(self, text: str) -> List[str]:
+        """Return the distinct keywords found in already-lowercased text"""
+        return [self.keywords[keyword_id] for keyword_id in sorted(self._scan(text))]
+    
+    def score(self, text: str) -> Dict[str, int]:
+        """Count distinct keyword hits per group, in group declaration order"""
+        counts = [0] * len(self.groups)
+        for keyword_id in self._scan(text):
+            for group_index in self._keyword_groups[keyword_id]:
+                counts[group_index] += 1
+        return {self.groups[i]: count for i, count in enumerate(counts) if count > 0}
+
+
+class QueryContext(NamedTuple):
+    """Everything the pipeline needs to know about a query, computed in one pass"""
+    query: str
+    text: str
+    tokens: Tuple[str, ...]
+    category_scores: Dict[str, int]
+    intents: frozenset
+    programs: Tuple["ProgramFees", ...]
+    corrections: Dict[str, str]
+    
+    @property
+    def search_text(self) -> str:
+        """Query to retrieve with: the corrected text when a typo was fixed"""
+        return self.text if self.corrections else self.query
+    
+    def has(self, *intents: str) -> bool:
+        """True if any of the given intents was detected"""
+        return not self.intents.isdisjoint(intents)
+
+
+class QueryAnalyzer:
+    """Single analysis pass shared by the router and the response generator
+    
+    Category keywords and intent keywords live in one automaton, so routing
+    scores and intents come out of the same scan; program names are matched
+    against the fee index on the normalized tokens. With a knowledge snapshot,
+    misspelled words ("nursng", "libary") are first corrected towards keywords
+    and program names, and ``text``/``tokens`` hold the corrected query.
+    """
+    
+    INTENTS = {
+        "payment": ["pay", "payment", "bank", "paybill"],
+        "cost": ["how much", "cost", "fee", "tuition", "price", "charge", "afford", "expensive"],
+        "mpesa": ["mpesa", "m-pesa", "m pesa"],
+        "gpa": ["gpa"],
+        "programs": ["program", "programme"],
+        "library": ["library"],
+        "hours": ["hour", "opening time", "closing time"],
+        "location": ["where is", "classroom", "building"],
+        "cafeteria": ["cafeteria", "meal"],
+        "counseling": ["counsel", "counseling", "counselling", "counselor", "counsellor"],
+        "health": ["health", "medical"],
+        "scholarship": ["scholarship", "financial aid"],
+        "substances": ["alcohol", "drug", "smoking"],
+        "sanctions": ["sanction", "violation", "discipline"]
+    }
+    
+    def __init__(self, categories: Dict[str, List[str]]):
+        groups = {("category", name): keywords for name, keywords in categories.items()}
+        groups.update({("intent", name): keywords for name, keywords in self.INTENTS.items()})
+        self.matcher = KeywordMatcher(groups)
+    
+    def analyze(self, query: str, knowledge: Optional["KnowledgeSnapshot"] = None) -> QueryContext:
+        """Lowercase, tokenize, correct and scan the query once"""
+        text = query.lower()
+        tokens = tuple(normalize_text(text).split())
+        corrections = knowledge.corrections(tokens) if knowledge is not None else {}
+        if corrections:
+            text = re.sub(r"[a-z0-9]+", lambda match: corrections.get(match.group(0), match.group(0)), text)
+            tokens = tuple(corrections.get(token, token) for token in tokens)
+        category_scores = {}
+        intents = set()
+        for (kind, name), count in self.matcher.score(text).items():
+            if kind == "category":
+                category_scores[name] = count
+            else:
+                intents.add(name)
+        programs = tuple(knowledge.fees.find_tokens(tokens)) if knowledge is not None else ()
+        return QueryContext(query, text, tokens, category_scores, frozenset(intents), programs, corrections)
+
 
 class QueryRouterAgent:
     """Routes queries to appropriate knowledge domains"""
     
     CATEGORIES = {
-        "fees_financial": ["fee", "cost", "tuition", "payment", "pay", "bank", "mpesa", "price", "charge"],
+        "fees_financial": ["fee", "cost", "tuition", "payment", "pay", "paybill", "bank", "mpesa", "m-pesa", "m pesa",
+                           "price", "charge"],
         "academic": ["program", "course", "degree", "major", "gpa", "grade", "credit", "graduation", "admission"],
         "facilities": ["library", "lab", "classroom", "building", "cafeteria", "gym", "hostel", "where is"],
         "services": ["counseling", "health", "career", "financial aid", "scholarship", "housing"],
@@ -19,179 +212,1319 @@ class QueryRouterAgent:
         "general": []
     }
     
+    # Clause boundaries a compound question is split on
+    CLAUSE_SPLIT = re.compile(r"[?;,]+\s*(?:(?:and also|as well as|and|also|plus)\s+)?|"
+                              r"\s+(?:and also|as well as|and|also|plus)\s+", re.IGNORECASE)
+    
+    def __init__(self, min_score: int = 1, retriever: Optional["KnowledgeRetrieverAgent"] = None):
+        # Compile the keyword table once; routing cost then depends on query length only
+        self.analyzer = QueryAnalyzer(self.CATEGORIES)
+        # Keyword hits a category needs before it counts as a separate intent
+        self.min_score = min_score
+        # Supplies the lexicon for spelling correction and program detection
+        self.retriever = retriever
+    
+    def analyze(self, query: str, knowledge: Optional["KnowledgeSnapshot"] = None) -> QueryContext:
+        """Run the shared analysis pass for a query, against the retriever's lexicon by default"""
+        if knowledge is None and self.retriever is not None:
+            knowledge = self.retriever.lexicon
+        return self.analyzer.analyze(query, knowledge)
+    
+    def classify(self, context: QueryContext) -> str:
+        """Determine the category of an analyzed query"""
+        # "How much is the nursing degree" names a program and asks a price
+        if context.programs and context.has("cost"):
+            return "fees_financial"
+        scores = context.category_scores
+        if scores:
+            return max(scores, key=scores.get)
+        return "general"
+    
     def route(self, query: str) -> str:
         """Determine query category"""
-        query_lower = query.lower()
+        return self.classify(self.analyze(query))
+    
+    def decompose(self, context: QueryContext,
+                  knowledge: Optional["KnowledgeSnapshot"] = None) -> List[Tuple[str, QueryContext]]:
+        """Split a compound question into one (category, sub-query) part per category
         
-        scores = {}
-        for category, keywords in self.CATEGORIES.items():
-            score = sum(1 for keyword in keywords if keyword in query_lower)
-            if score > 0:
-                scores[category] = score
+        Clauses are split at conjunctions and question marks; a clause with no
+        category of its own stays with the one before it, and clauses of the
+        same category are answered together. Returns an empty list when fewer
+        than two categories reach ``min_score``, so single-intent queries are
+        routed as a whole.
+        """
+        if sum(1 for score in context.category_scores.values() if score >= self.min_score) < 2:
+            return []
         
-        if scores:
-            return max(scores, key=scores.get)
-        return "general"
+        clauses = {}
+        category = None
+        for clause in self.CLAUSE_SPLIT.split(context.query):
+            clause = clause.strip(" ,.!")
+            if not clause:
+                continue
+            scores = self.analyzer.analyze(clause).category_scores
+            best = max(scores, key=scores.get) if scores else None
+            if best is not None and scores[best] >= self.min_score:
+                category = best
+            # A leading clause without a category waits for the next one that has one
+            clauses.setdefault(category, []).append(clause)
+        
+        leading = clauses.pop(None, [])
+        if len(clauses) < 2:
+            return []
+        first = next(iter(clauses))
+        clauses[first] = leading + clauses[first]
+        return [(category, self.analyzer.analyze(", ".join(parts), knowledge)) for category, parts in clauses.items()]
+    
+    def route_many(self, queries: List[str]) -> List[str]:
+        """Determine categories for several queries, preserving order"""
+        return [self.route(query) for query in queries]
+
+
+def json_pointer(parts: List[Any]) -> str:
+    """Build an RFC 6901 JSON pointer from a list of keys and indices"""
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in parts)
+
+
+def flatten_knowledge(filename: str, data: Any) -> List[Tuple[str, Any, str]]:
+    """Flatten a JSON document into (path, value, indexed_text) leaf chunks
+    
+    Paths look like ``fees_financial_info.json#/payment_methods/mpesa/business_number``.
+    The indexed text holds the leaf's key names, any label of its enclosing
+    records (``name``, ``program_name``, ``bank`` ...) and the value itself.
+    """
+    chunks = []
+    stack = [([], data, "")]
+    while stack:
+        parts, node, context = stack.pop()
+        if isinstance(node, Mapping):
+            labels = [str(node[key]) for key in KnowledgeIndex.LABEL_KEYS if isinstance(node.get(key), str)]
+            child_context = " ".join([context] + labels).strip()
+            for key in reversed(list(node.keys())):
+                stack.append((parts + [key], node[key], child_context))
+        elif isinstance(node, (list, tuple)):
+            for index in reversed(range(len(node))):
+                stack.append((parts + [index], node[index], context))
+        else:
+            keys = " ".join(str(part) for part in parts if not isinstance(part, int))
+            text = f"{keys} {context} {node}"
+            chunks.append((f"{filename}#{json_pointer(parts)}", node, text))
+    return chunks
+
+
+class KnowledgeIndex:
+    """BM25 inverted index over flattened knowledge leaves
+    
+    Postings are kept per file and weighted at query time against corpus-wide
+    statistics, so a snapshot that loads, evicts or reloads one file only
+    tokenizes that file.
+    """
+    
+    K1 = 1.5
+    B = 0.75
+    LABEL_KEYS = ("name", "program_name", "program", "bank", "title")
+    STOPWORDS = {
+        "a", "an", "and", "are", "at", "be", "by", "can", "do", "for", "from", "how",
+        "i", "in", "is", "it", "me", "my", "of", "on", "or", "the", "to", "what",
+        "when", "where", "which", "with", "you"
+    }
+    
+    def __init__(self, documents: Dict[str, Any], previous: Optional["KnowledgeIndex"] = None,
+                 changed: Optional[set] = None):
+        # Each file is flattened, tokenized and posted once; unchanged files reuse
+        # the previous index's segments, and the corpus-wide statistics BM25 needs
+        # are adjusted for the files that came, went or changed
+        reuse = previous is not None and changed is not None
+        self.chunks = {}
+        self.segments = {}
+        for filename, data in documents.items():
+            if reuse and filename not in changed and filename in previous.segments:
+                self.chunks[filename] = previous.chunks[filename]
+                self.segments[filename] = previous.segments[filename]
+            else:
+                self.chunks[filename] = flatten_knowledge(filename, data)
+                self.segments[filename] = self._segment(self.chunks[filename])
+        
+        if reuse:
+            self.document_frequency = dict(previous.document_frequency)
+            self.total_length = previous.total_length
+            for filename, segment in previous.segments.items():
+                if self.segments.get(filename) is not segment:
+                    self._count_segment(segment, -1)
+            for filename, segment in self.segments.items():
+                if previous.segments.get(filename) is not segment:
+                    self._count_segment(segment, 1)
+        else:
+            self.document_frequency = {}
+            self.total_length = 0
+            for segment in self.segments.values():
+                self._count_segment(segment, 1)
+        
+        self.paths = []
+        self.values = []
+        self.files = []
+        self.lengths = []
+        self.offsets = {}
+        for filename, chunks in self.chunks.items():
+            self.offsets[filename] = len(self.paths)
+            self.paths.extend(path for path, value, text in chunks)
+            self.values.extend(value for path, value, text in chunks)
+            self.files.extend([filename] * len(chunks))
+            self.lengths.extend(self.segments[filename][0])
+        self._fingerprint = None
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """Lowercase, split on non-alphanumerics, drop stopwords and fold plurals"""
+        tokens = []
+        for token in re.findall(r"[a-z0-9]+", str(text).lower()):
+            if token in cls.STOPWORDS:
+                continue
+            if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+                token = token[:-1]
+            tokens.append(token)
+        return tokens
+    
+    @classmethod
+    def _segment(cls, chunks: List[Tuple[str, Any, str]]) -> Tuple[List[int], Dict[str, List[Tuple[int, int]]]]:
+        """Chunk lengths and term -> [(local chunk id, term frequency)] postings of one file"""
+        lengths = []
+        postings = {}
+        for local_id, (path, value, text) in enumerate(chunks):
+            counts = {}
+            for token in cls.tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((local_id, tf))
+        return lengths, postings
+    
+    def _count_segment(self, segment: Tuple[List[int], Dict[str, List[Tuple[int, int]]]], sign: int):
+        """Add (sign=1) or remove (sign=-1) one file's chunks from the corpus statistics"""
+        lengths, postings = segment
+        self.total_length += sign * sum(lengths)
+        for term, entries in postings.items():
+            df = self.document_frequency.get(term, 0) + sign * len(entries)
+            if df:
+                self.document_frequency[term] = df
+            else:
+                self.document_frequency.pop(term, None)
+    
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the exact chunk list, so persisted embeddings can be matched to it"""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for chunks in self.chunks.values():
+                for path, value, text in chunks:
+                    digest.update(f"{path}\n{text}\n".encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+    
+    def texts(self) -> List[str]:
+        """Indexed text of every chunk, in chunk id order"""
+        return [text for chunks in self.chunks.values() for path, value, text in chunks]
+    
+    def search(self, query: str, files: Optional[List[str]] = None, top_k: int = 8) -> List[Tuple[str, Any, float]]:
+        """Return the top-k (path, value, score) passages for a query"""
+        return self.search_many([query], files, top_k)[0]
+    
+    def search_many(self, queries: List[str], files: Optional[List[str]] = None,
+                    top_k: int = 8) -> List[List[Tuple[str, Any, float]]]:
+        """Search several queries against the same file subset
+        
+        BM25 weights are computed from each file's term frequencies and the
+        corpus-wide statistics at query time, so loading or evicting a file
+        never re-weights the others.
+        """
+        segments = [(self.offsets[filename], self.segments[filename][1]) for filename in self.segments
+                    if files is None or filename in files]
+        total = len(self.paths)
+        average_length = self.total_length / total if total else 0.0
+        results = []
+        for query in queries:
+            scores = {}
+            for term in set(self.tokenize(query)):
+                df = self.document_frequency.get(term)
+                if not df:
+                    continue
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                for offset, postings in segments:
+                    for local_id, tf in postings.get(term, ()):
+                        chunk_id = offset + local_id
+                        norm = self.K1 * (1 - self.B + self.B * self.lengths[chunk_id] / average_length) \
+                            if average_length else self.K1
+                        scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+            
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            results.append([(self.paths[chunk_id], self.values[chunk_id], score) for chunk_id, score in best])
+        return results
+
+
+class FeeSchedule(NamedTuple):
+    """Per-residency totals for one billing schedule of a program"""
+    label: str
+    kenyan: Optional[int]
+    east_african: Optional[int]
+    non_east_african: Optional[int]
+
+
+class ProgramFees(NamedTuple):
+    """Fee record for a single program"""
+    program: str
+    level: str
+    schedules: Tuple[FeeSchedule, ...]
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and collapse to space-separated alphanumeric tokens"""
+    return " ".join(re.findall(r"[a-z0-9]+", str(text).lower().replace("&", " and ")))
+
+
+class FeeIndex:
+    """Program fee lookup table built once from the fee schedules
+    
+    Every program in ``undergraduate_programs``, ``graduate_programs``,
+    ``doctoral_programs`` and ``online_programs`` (plus ``fee_schedules`` in
+    fees_financial_info.json) is keyed by its normalized name and aliases, so a
+    lookup is a handful of dict hits over the query's n-grams.
+    """
+    
+    FEE_SECTIONS = ["undergraduate_programs", "graduate_programs", "doctoral_programs", "online_programs"]
+    RESIDENCIES = {
+        "kenyan": "kenyan", "kenyan_students": "kenyan",
+        "east_african": "east_african", "east_african_students": "east_african",
+        "non_east_african": "non_east_african", "non_east_african_students": "non_east_african"
+    }
+    DEGREE_PREFIX = re.compile(r"^(?:online )?(?:bachelor|masters?|doctor) (?:of (?:science|arts|philosophy) )?(?:in |of )?")
+    # Words that name an office or a fee line as often as a program
+    GENERIC_WORDS = {"finance", "management", "technology"}
+    
+    def __init__(self, documents: Dict[str, Any]):
+        self.programs = {}
+        self.aliases = {}
+        self._secondary = {}
+        self._subject_acronyms = {}
+        
+        fees = documents.get("all_programs_fees_2025_2026.json", {})
+        for section in self.FEE_SECTIONS:
+            level = section.replace("_programs", "")
+            for key, entry in fees.get(section, {}).items():
+                if section == "online_programs" and isinstance(entry, Mapping):
+                    # Online programs are nested one level deeper, by study level
+                    for online_entry in entry.values():
+                        self._add_entry(online_entry, f"online {key}")
+                else:
+                    self._add_entry(entry, level)
+        
+        for entry in documents.get("fees_financial_info.json", {}).get("fee_schedules", {}).values():
+            self._add_entry(entry, "undergraduate")
+        
+        self._prune_secondary()
+        self.max_alias_tokens = max((len(alias.split()) for alias in self.aliases), default=0)
+        self.max_alias_tokens = max([self.max_alias_tokens] + [len(alias.split()) for alias in self._secondary])
+    
+    def _add_entry(self, entry: Any, level: str):
+        """Index one fee entry, which may cover a single program or a group"""
+        if not isinstance(entry, Mapping):
+            return
+        names = entry.get("programs") or [entry.get("program") or entry.get("program_name")]
+        schedules = self._schedules(entry)
+        if not schedules:
+            return
+        for name in names:
+            if not name or normalize_text(name) in self.programs:
+                continue
+            record = ProgramFees(program=name, level=level, schedules=schedules)
+            self.programs[normalize_text(name)] = record
+            self._add_aliases(name, record)
+    
+    def _schedules(self, entry: Dict[str, Any]) -> Tuple[FeeSchedule, ...]:
+        """Collect (schedule, residency) -> total from a fee entry"""
+        totals = {}
+        stack = [((), entry)]
+        while stack:
+            keys, node = stack.pop()
+            if not isinstance(node, Mapping):
+                continue
+            residency = next((self.RESIDENCIES[key] for key in keys if key in self.RESIDENCIES), None)
+            if residency and isinstance(node.get("total"), int):
+                label = " ".join(key for key in keys if key not in self.RESIDENCIES)
+                totals.setdefault(label, {})[residency] = node["total"]
+                continue
+            for key, value in node.items():
+                stack.append((keys + (key,), value))
+        
+        schedules = []
+        for label in sorted(totals, key=self._label_order):
+            residency_totals = totals[label]
+            schedules.append(FeeSchedule(
+                label=(label or "fees_per_semester").replace("fees_per_semester", "per semester").replace("_", " ").title(),
+                kenyan=residency_totals.get("kenyan"),
+                east_african=residency_totals.get("east_african"),
+                non_east_african=residency_totals.get("non_east_african")
+            ))
+        return tuple(schedules)
+    
+    @staticmethod
+    def _label_order(label: str) -> Tuple[int, str]:
+        """Keep per-semester and regular schedules ahead of the others"""
+        order = ["fees_per_semester", "regular_courses", "foundational_courses"]
+        return (order.index(label) if label in order else len(order), label)
+    
+    def _add_aliases(self, name: str, record: ProgramFees):
+        """Register a program under its name, acronym and subject"""
+        full = normalize_text(name)
+        acronyms = re.findall(r"\(([^)]+)\)", name)
+        plain = normalize_text(re.sub(r"\([^)]*\)", " ", name))
+        subject = self.DEGREE_PREFIX.sub("", plain)
+        
+        primary = {full, plain, subject}
+        primary.update(normalize_text(acronym) for acronym in acronyms)
+        if subject.endswith(" studies"):
+            primary.add(subject[:-len(" studies")])
+        if plain.startswith("online "):
+            # "online mba" borrows the acronym of the on-campus program at the
+            # same level, so the Online MBA does not also answer to "online dba"
+            campus_level = record.level[len("online "):] if record.level.startswith("online ") else record.level
+            primary.add("online " + subject)
+            primary.update("online " + acronym for acronym in self._subject_acronyms.get((subject, campus_level), ()))
+        else:
+            self._subject_acronyms.setdefault((subject, record.level), set()).update(normalize_text(a) for a in acronyms)
+        for alias in primary - self.GENERIC_WORDS:
+            if alias:
+                self.aliases.setdefault(alias, []).append(record)
+        
+        # Halves of compound subjects ("artificial intelligence and robotics")
+        # only count when no primary alias of the same length matches
+        for part in subject.split(" and "):
+            if part and part != subject and part not in primary:
+                self._secondary.setdefault(part, []).append(record)
+    
+    def _prune_secondary(self):
+        """Drop compound-subject halves whose words also name other programs"""
+        for part in list(self._secondary):
+            owners = {record.program for record in self._secondary[part]}
+            others = [name for name, record in self.programs.items() if record.program not in owners]
+            if part in self.GENERIC_WORDS or any(set(part.split()) & set(name.split()) for name in others):
+                del self._secondary[part]
+    
+    def find(self, query: str) -> List[ProgramFees]:
+        """Return the programs named in a query, preferring the longest alias"""
+        return self.find_tokens(normalize_text(query).split())
+    
+    def find_tokens(self, tokens: Tuple[str, ...]) -> List[ProgramFees]:
+        """Program lookup on an already normalized token sequence"""
+        for size in range(min(self.max_alias_tokens, len(tokens)), 0, -1):
+            for table in (self.aliases, self._secondary):
+                matches = []
+                for start in range(len(tokens) - size + 1):
+                    # "online dba" names no program; it must not fall back to the on-campus one
+                    online = start > 0 and tokens[start - 1] == "online"
+                    for record in table.get(" ".join(tokens[start:start + size]), ()):
+                        if online and not record.level.startswith("online "):
+                            continue
+                        if record not in matches:
+                            matches.append(record)
+                if matches:
+                    return matches
+        return []
+
+
+class TrigramIndex:
+    """Typo-tolerant lookup of query words against a fixed vocabulary
+    
+    Terms are split into padded character trigrams ("$li", "lib", ...) with an
+    inverted list per trigram, so a lookup only scores terms sharing at least
+    one trigram with the word rather than comparing it to the whole vocabulary.
+    Similarity is the Dice coefficient of the two trigram sets.
+    """
+    
+    MIN_LENGTH = 4
+    THRESHOLD = 0.55
+    
+    def __init__(self, terms: List[str]):
+        self.terms = sorted({term for term in terms if len(term) >= self.MIN_LENGTH and not term.isdigit()})
+        self.term_set = set(self.terms)
+        self.sizes = []
+        self.postings = {}
+        for term_id, term in enumerate(self.terms):
+            grams = self.trigrams(term)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(term_id)
+    
+    @staticmethod
+    def trigrams(word: str) -> set:
+        padded = f"${word}$"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def lookup(self, word: str) -> Optional[str]:
+        """Closest vocabulary term to a word, or None if nothing is similar enough"""
+        if word in self.term_set:
+            return word
+        grams = self.trigrams(word)
+        shared = {}
+        for gram in grams:
+            for term_id in self.postings.get(gram, ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+        best, best_key = None, None
+        for term_id, count in shared.items():
+            score = 2.0 * count / (len(grams) + self.sizes[term_id])
+            if score < self.THRESHOLD:
+                continue
+            key = (score, -abs(len(self.terms[term_id]) - len(word)))
+            if best_key is None or key > best_key:
+                best, best_key = self.terms[term_id], key
+        return best
+
+
+class HashingEncoder:
+    """Deterministic local text encoder: signed feature hashing of words and word pairs
+    
+    A stand-in for a sentence-transformer that needs no model download, so the
+    dense index can be built and tested offline. It captures lexical overlap,
+    not meaning.
+    """
+    
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.spec = {"type": "hashing", "dim": dim}
+    
+    def _features(self, text: str) -> List[str]:
+        tokens = KnowledgeIndex.tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        """Encode texts into L2-normalized float32 rows"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.md5(feature.encode("utf-8")).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                matrix[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEncoder:
+    """Semantic encoder backed by sentence-transformers (loaded on first use)"""
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        self.model_name = model_name
+        self.spec = {"type": "sentence-transformers", "model": model_name}
+        self._model = None
+    
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        """Encode texts into L2-normalized float32 rows"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        vectors = self._model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32)
+
+
+def make_encoder(spec: Dict[str, Any]):
+    """Rebuild the encoder described by an embeddings manifest"""
+    if spec.get("type") == "hashing":
+        return HashingEncoder(spec.get("dim", 384))
+    return SentenceTransformerEncoder(spec.get("model", "all-MiniLM-L6-v2"))
+
+
+class DenseIndex:
+    """Chunk embeddings in a memory-mapped float32 matrix, scored with one mat-vec
+    
+    ``build`` runs offline and writes ``embeddings.npy`` plus a JSON manifest;
+    every worker then maps the same file read-only instead of re-encoding.
+    """
+    
+    MATRIX_FILE = "embeddings.npy"
+    MANIFEST_FILE = "embeddings.json"
+    
+    def __init__(self, matrix: "np.ndarray", files: List[str], fingerprint: str, encoder):
+        self.matrix = matrix
+        self.fingerprint = fingerprint
+        self.encoder = encoder
+        self._file_ids = {name: i for i, name in enumerate(dict.fromkeys(files))}
+        self._row_files = np.array([self._file_ids[name] for name in files], dtype=np.int32)
+        self._masks = {}
+    
+    @classmethod
+    def build(cls, index: KnowledgeIndex, encoder, output_dir: str) -> "DenseIndex":
+        """Encode every chunk and persist the matrix and manifest"""
+        os.makedirs(output_dir, exist_ok=True)
+        matrix = encoder.encode(index.texts()).astype(np.float32)
+        np.save(os.path.join(output_dir, cls.MATRIX_FILE), matrix)
+        with open(os.path.join(output_dir, cls.MANIFEST_FILE), "w") as f:
+            json.dump({"encoder": encoder.spec, "fingerprint": index.fingerprint, "files": index.files}, f)
+        return cls(matrix, index.files, index.fingerprint, encoder)
+    
+    @classmethod
+    def load(cls, directory: str, encoder=None) -> Optional["DenseIndex"]:
+        """Memory-map persisted embeddings, or None if they were never built"""
+        manifest_path = os.path.join(directory, cls.MANIFEST_FILE)
+        if np is None or not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        matrix = np.load(os.path.join(directory, cls.MATRIX_FILE), mmap_mode="r")
+        return cls(matrix, manifest["files"], manifest["fingerprint"], encoder or make_encoder(manifest["encoder"]))
+    
+    def _mask(self, files: Optional[List[str]]) -> Optional["np.ndarray"]:
+        if files is None:
+            return None
+        key = tuple(files)
+        if key not in self._masks:
+            ids = [self._file_ids[name] for name in files if name in self._file_ids]
+            self._masks[key] = np.isin(self._row_files, ids)
+        return self._masks[key]
+    
+    def search(self, query: str, files: Optional[List[str]] = None, top_k: int = 8) -> List[Tuple[int, float]]:
+        """Return the top-k (chunk_id, cosine similarity) for a query"""
+        scores = self.matrix @ self.encoder.encode([query])[0]
+        mask = self._mask(files)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+# Compiled snapshot files start with these bytes; bump the format whenever the
+# pickled classes change shape so old builds are rejected instead of misread
+SNAPSHOT_MAGIC = b"USIUKB\x00"
+SNAPSHOT_FORMAT = 4
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate bytes held by a parsed JSON value, counting shared objects once"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        elif isinstance(item, CompactRecord):
+            stack.extend((item._shape, item._values))
+        elif isinstance(item, RecordShape):
+            stack.extend((item.keys, item.positions))
+    return total
+
+
+class RecordShape:
+    """Key layout shared by every compact record with the same keys in the same order"""
+    
+    __slots__ = ("keys", "positions")
+    
+    # A shape costs about as much as three small dicts, so fewer records do not pay for it
+    MIN_RECORDS = 4
+    
+    def __init__(self, keys: Tuple[str, ...]):
+        self.keys = keys
+        self.positions = {key: index for index, key in enumerate(keys)}
+
+
+class CompactRecord(Mapping):
+    """Read-only, tuple-backed stand-in for a parsed JSON object
+    
+    Holds only a reference to its shared RecordShape and a tuple of values,
+    instead of a per-object hash table and key references.
+    """
+    
+    __slots__ = ("_shape", "_values")
+    
+    def __init__(self, shape: RecordShape, values: Tuple[Any, ...]):
+        self._shape = shape
+        self._values = values
+    
+    def __getitem__(self, key: str) -> Any:
+        index = self._shape.positions.get(key)
+        if index is None:
+            raise KeyError(key)
+        return self._values[index]
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        index = self._shape.positions.get(key)
+        return default if index is None else self._values[index]
+    
+    def __contains__(self, key: object) -> bool:
+        return key in self._shape.positions
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._shape.keys)
+    
+    def __len__(self) -> int:
+        return len(self._values)
+    
+    def __repr__(self) -> str:
+        return f"CompactRecord({dict(self)!r})"
+
+
+def count_record_shapes(value: Any) -> Dict[Tuple[str, ...], int]:
+    """How many JSON objects in a document share each key sequence"""
+    counts = {}
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            keys = tuple(item)
+            counts[keys] = counts.get(keys, 0) + 1
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return counts
+
+
+def compact_json(value: Any, shapes: Dict[Tuple[str, ...], RecordShape],
+                 counts: Optional[Dict[Tuple[str, ...], int]] = None, strings: Optional[Dict[str, str]] = None) -> Any:
+    """Rebuild parsed JSON with interned keys, shared record shapes and tuples for lists
+    
+    Only objects whose key sequence repeats often enough to pay for the shared
+    shape become CompactRecords; the rest stay dicts with interned keys.
+    Repeated string values are stored once.
+    """
+    if counts is None:
+        counts = count_record_shapes(value)
+    if strings is None:
+        strings = {}
+    if isinstance(value, dict):
+        keys = tuple(sys.intern(key) for key in value)
+        values = [compact_json(item, shapes, counts, strings) for item in value.values()]
+        shape = shapes.get(keys)
+        if shape is None and counts.get(keys, 0) >= RecordShape.MIN_RECORDS:
+            shape = shapes[keys] = RecordShape(keys)
+        if shape is None:
+            return dict(zip(keys, values))
+        return CompactRecord(shape, tuple(values))
+    if isinstance(value, list):
+        return tuple(compact_json(item, shapes, counts, strings) for item in value)
+    if isinstance(value, str):
+        return strings.setdefault(value, value)
+    return value
+
+
+class KnowledgeSnapshot:
+    """Immutable view of the loaded knowledge and the indexes derived from it
+    
+    The retriever swaps whole snapshots, so a request that grabbed one keeps a
+    consistent view even while a reload is in progress.
+    """
+    
+    FEE_FILES = {"all_programs_fees_2025_2026.json", "fees_financial_info.json"}
+    # Files whose names feed query analysis (program lookup and spelling correction)
+    LEXICON_FILES = FEE_FILES | {"programs.json"}
+    SNAPSHOT_FILE = "knowledge.snapshot"
+    
+    def __init__(self, documents: Dict[str, Any], mtimes: Dict[str, float], version: int,
+                 previous: Optional["KnowledgeSnapshot"] = None, changed: Optional[set] = None):
+        self.documents = documents
+        self.mtimes = mtimes
+        self.version = version
+        self.content_hash = None
+        self.sizes = {}
+        for filename, data in documents.items():
+            if previous is not None and changed is not None and filename not in changed and filename in previous.sizes:
+                self.sizes[filename] = previous.sizes[filename]
+            else:
+                self.sizes[filename] = deep_sizeof(data)
+        self.index = KnowledgeIndex(documents, previous.index if previous else None, changed)
+        if previous is not None and changed is not None and not (changed & self.FEE_FILES):
+            self.fees = previous.fees
+        else:
+            self.fees = FeeIndex(documents)
+        if previous is not None and changed is not None and not (changed & self.LEXICON_FILES):
+            self.spelling = previous.spelling
+        else:
+            self.spelling = TrigramIndex(self._lexicon_terms(documents, self.fees))
+    
+    @staticmethod
+    def _lexicon_terms(documents: Dict[str, Any], fees: FeeIndex) -> List[str]:
+        """Words worth correcting a typo towards: router/intent keywords and program names"""
+        terms = []
+        for groups in (QueryRouterAgent.CATEGORIES, QueryAnalyzer.INTENTS):
+            for keywords in groups.values():
+                for keyword in keywords:
+                    terms.extend(normalize_text(keyword).split())
+        for alias in fees.aliases:
+            terms.extend(alias.split())
+        for program in documents.get("programs.json", {}).get("programs", []):
+            if isinstance(program, Mapping):
+                terms.extend(normalize_text(program.get("program_name", "")).split())
+        return [term for term in terms if term not in KnowledgeIndex.STOPWORDS]
+    
+    def corrections(self, tokens: Tuple[str, ...]) -> Dict[str, str]:
+        """Map misspelled query tokens to their closest keyword or program word
+        
+        Only tokens the knowledge base has never seen are candidates, so real
+        words that merely resemble a keyword are left alone.
+        """
+        fixes = {}
+        for token in tokens:
+            if len(token) < TrigramIndex.MIN_LENGTH or token in self.spelling.term_set or token in fixes:
+                continue
+            terms = KnowledgeIndex.tokenize(token)
+            if not terms or terms[0] in self.index.document_frequency:
+                continue
+            match = self.spelling.lookup(token)
+            if match is not None:
+                fixes[token] = match
+        return fixes
+    
+    @staticmethod
+    def source_manifest(knowledge_dir: str, filenames: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Size, mtime and sha256 of each knowledge file that exists"""
+        manifest = {}
+        for filename in filenames:
+            filepath = os.path.join(knowledge_dir, filename)
+            try:
+                with open(filepath, "rb") as f:
+                    content = f.read()
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            manifest[filename] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": hashlib.sha256(content).hexdigest()
+            }
+        return manifest
+    
+    def save(self, path: str, sources: Dict[str, Dict[str, Any]]):
+        """Write the compiled snapshot: header, source manifest, then the pickled snapshot"""
+        content_hash = hashlib.sha256(
+            "".join(f"{name}:{info['sha256']};" for name, info in sorted(sources.items())).encode("utf-8")
+        ).hexdigest()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_FORMAT]))
+            pickle.dump({"sources": sources, "content_hash": content_hash}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    
+    @classmethod
+    def load(cls, path: str, knowledge_dir: str, filenames: List[str]) -> Optional["KnowledgeSnapshot"]:
+        """Compiled snapshot at path, or None if it is missing, from another format or stale
+        
+        Files whose size and mtime match the manifest are trusted; anything else
+        is re-hashed so a touched but unchanged file does not invalidate the build.
+        """
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        with f:
+            header = f.read(len(SNAPSHOT_MAGIC) + 1)
+            if header != SNAPSHOT_MAGIC + bytes([SNAPSHOT_FORMAT]):
+                return None
+            try:
+                manifest = pickle.load(f)
+            except Exception as e:
+                print(f"Error loading knowledge snapshot {path}: {e}")
+                return None
+            sources = manifest["sources"]
+            mtimes = {}
+            for filename in filenames:
+                filepath = os.path.join(knowledge_dir, filename)
+                expected = sources.get(filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    if expected is not None:
+                        return None
+                    mtimes[filename] = None
+                    continue
+                if expected is None or stat.st_size != expected["size"]:
+                    return None
+                if stat.st_mtime != expected["mtime"]:
+                    with open(filepath, "rb") as source:
+                        if hashlib.sha256(source.read()).hexdigest() != expected["sha256"]:
+                            return None
+                mtimes[filename] = stat.st_mtime
+            try:
+                snapshot = pickle.load(f)
+            except Exception as e:
+                print(f"Error loading knowledge snapshot {path}: {e}")
+                return None
+        snapshot.mtimes = mtimes
+        snapshot.content_hash = manifest["content_hash"]
+        return snapshot
 
 
 class KnowledgeRetrieverAgent:
     """Retrieves relevant information from JSON knowledge base"""
     
-    def __init__(self, knowledge_dir: str = "knowledge"):
+    JSON_FILES = [
+        "academic_policies_procedures.json",
+        "all_programs_fees_2025_2026.json",
+        "campus_facilities_services.json",
+        "fees_financial_info.json",
+        "mastercard_foundation_scholars.json",
+        "programs.json",
+        "student_conduct_discipline.json",
+        "student_services_policies.json"
+    ]
+    
+    # Map categories to knowledge files
+    FILE_MAPPING = {
+        "fees_financial": ["all_programs_fees_2025_2026.json", "fees_financial_info.json"],
+        "academic": ["academic_policies_procedures.json", "programs.json"],
+        "facilities": ["campus_facilities_services.json"],
+        "services": ["student_services_policies.json", "mastercard_foundation_scholars.json"],
+        "conduct": ["student_conduct_discipline.json"]
+    }
+    
+    # Weight of each ranking in reciprocal rank fusion
+    RRF_K = 60
+    
+    def __init__(self, knowledge_dir: str = "knowledge", top_k: int = 8, embeddings_dir: Optional[str] = None,
+                 encoder=None, snapshot_path: Optional[str] = None, lazy: bool = False,
+                 memory_limit: Optional[int] = None, compact: bool = False):
         self.knowledge_dir = knowledge_dir
-        self.cache = {}
-        self._load_knowledge()
+        self.top_k = top_k
+        self.lazy = lazy
+        self.memory_limit = memory_limit
+        self.compact = compact
+        self._shapes = {}
+        self._reload_lock = threading.Lock()
+        # mtime of the last unparseable version of each file that failed to reload
+        self._failed_mtimes = {}
+        self._last_used = OrderedDict()
+        self._usage_lock = threading.Lock()
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        # The compiled snapshot holds the whole corpus, so lazy mode parses files on demand instead
+        if snapshot_path and not lazy:
+            self.snapshot = KnowledgeSnapshot.load(snapshot_path, knowledge_dir, self.JSON_FILES)
+        else:
+            self.snapshot = None
+        if self.snapshot is None:
+            if snapshot_path and not lazy and os.path.exists(snapshot_path):
+                print(f"Knowledge snapshot {snapshot_path} is stale or unreadable; loading the raw JSON files")
+            self._load_knowledge()
+        self.dense = DenseIndex.load(embeddings_dir, encoder) if embeddings_dir else None
+        # Embeddings cover the whole corpus, so in lazy mode they apply once every file is resident
+        if self.dense is not None and not self.lazy and not self.dense_ready():
+            print(f"Embeddings in {embeddings_dir} are stale; rebuild them to enable dense retrieval")
+    
+    # Readers always go through the current snapshot
+    @property
+    def cache(self) -> Dict[str, Any]:
+        return self.snapshot.documents
+    
+    @property
+    def index(self) -> KnowledgeIndex:
+        return self.snapshot.index
+    
+    @property
+    def fees(self) -> FeeIndex:
+        return self.lexicon.fees
+    
+    @property
+    def lexicon(self) -> "KnowledgeSnapshot":
+        """Snapshot whose fee index and spelling vocabulary query analysis can use"""
+        if self.lazy:
+            return self._ensure_loaded(sorted(KnowledgeSnapshot.LEXICON_FILES))
+        return self.snapshot
+    
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+    
+    def _mtime(self, filename: str) -> Optional[float]:
+        try:
+            return os.stat(os.path.join(self.knowledge_dir, filename)).st_mtime
+        except OSError:
+            return None
+    
+    def _load_file(self, filename: str) -> Optional[Any]:
+        """Parse one knowledge file, or None if it is missing or invalid"""
+        filepath = os.path.join(self.knowledge_dir, filename)
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, 'r') as f:
+                    data = json.load(f)
+                return compact_json(data, self._shapes) if self.compact else data
+            except Exception as e:
+                print(f"Error loading {filename}: {e}")
+        return None
     
     def _load_knowledge(self):
-        """Load all JSON files into memory"""
-        json_files = [
-            "academic_policies_procedures.json",
-            "all_programs_fees_2025_2026.json",
-            "campus_facilities_services.json",
-            "fees_financial_info.json",
-            "mastercard_foundation_scholars.json",
-            "programs.json",
-            "student_conduct_discipline.json",
-            "student_services_policies.json"
-        ]
+        """Load all JSON files into memory (none yet in lazy mode)"""
+        documents = {}
+        mtimes = {}
+        for filename in ([] if self.lazy else self.JSON_FILES):
+            mtimes[filename] = self._mtime(filename)
+            data = self._load_file(filename)
+            if data is not None:
+                documents[filename] = data
+        self.snapshot = KnowledgeSnapshot(documents, mtimes, version=1)
+    
+    def _ensure_loaded(self, filenames: List[str]) -> KnowledgeSnapshot:
+        """Snapshot with the given files resident, loading them on first use
         
-        for filename in json_files:
-            filepath = os.path.join(self.knowledge_dir, filename)
-            if os.path.exists(filepath):
-                try:
-                    with open(filepath, 'r') as f:
-                        self.cache[filename] = json.load(f)
-                except Exception as e:
-                    print(f"Error loading {filename}: {e}")
-    
-    def retrieve(self, category: str, query: str) -> Dict[str, Any]:
-        """Retrieve relevant knowledge based on category"""
-        
-        # Map categories to knowledge files
-        file_mapping = {
-            "fees_financial": ["all_programs_fees_2025_2026.json", "fees_financial_info.json"],
-            "academic": ["academic_policies_procedures.json", "programs.json"],
-            "facilities": ["campus_facilities_services.json"],
-            "services": ["student_services_policies.json", "mastercard_foundation_scholars.json"],
-            "conduct": ["student_conduct_discipline.json"],
-            "general": list(self.cache.keys())
+        A file counts as loaded once it has an mtime entry, even if it turned
+        out to be missing, so absent files are not retried on every query.
+        """
+        snapshot = self.snapshot
+        if self.memory_limit:
+            with self._usage_lock:
+                for filename in filenames:
+                    self._last_used[filename] = None
+                    self._last_used.move_to_end(filename)
+        if all(filename in snapshot.mtimes for filename in filenames):
+            return snapshot
+        
+        with self._reload_lock:
+            current = self.snapshot
+            missing = [filename for filename in filenames if filename not in current.mtimes]
+            if not missing:
+                return current
+            documents = dict(current.documents)
+            mtimes = dict(current.mtimes)
+            for filename in missing:
+                mtimes[filename] = self._mtime(filename)
+                data = self._load_file(filename)
+                if data is not None:
+                    documents[filename] = data
+            changed = set(missing)
+            
+            # Evict least recently used files until the parsed data fits the memory limit.
+            # Every query's analysis reads the lexicon files, so they stay resident and
+            # are not counted against the limit; evicting them would rebuild the fee
+            # and spelling indexes on the next query.
+            if self.memory_limit:
+                pinned = KnowledgeSnapshot.LEXICON_FILES
+                sizes = {filename: current.sizes.get(filename) or deep_sizeof(documents[filename])
+                         for filename in documents if filename not in pinned}
+                with self._usage_lock:
+                    candidates = [filename for filename in self._last_used
+                                  if filename not in filenames and filename not in pinned]
+                for filename in candidates:
+                    if sum(sizes.values()) <= self.memory_limit:
+                        break
+                    if filename in documents:
+                        del documents[filename]
+                        del mtimes[filename]
+                        sizes.pop(filename)
+                        changed.add(filename)
+            
+            # Content is unchanged, so the version (and cached answers) stay valid
+            self.snapshot = KnowledgeSnapshot(documents, mtimes, current.version, current, changed)
+            return self.snapshot
+    
+    def memory_stats(self) -> Dict[str, Any]:
+        """Resident size of each loaded knowledge file"""
+        snapshot = self.snapshot
+        return {
+            "lazy": self.lazy,
+            "compact": self.compact,
+            "memory_limit": self.memory_limit,
+            "resident_bytes": sum(snapshot.sizes.values()),
+            "files": dict(snapshot.sizes)
         }
+    
+    def reload(self) -> Dict[str, Any]:
+        """Re-parse loaded files whose mtime changed and atomically swap in a new snapshot"""
+        with self._reload_lock:
+            current = self.snapshot
+            filenames = list(current.mtimes) if self.lazy else self.JSON_FILES
+            mtimes = {filename: self._mtime(filename) for filename in filenames}
+            # A file that failed to parse is retried only once it is written again
+            touched = {filename for filename in filenames
+                       if mtimes[filename] != current.mtimes.get(filename)
+                       and mtimes[filename] != self._failed_mtimes.get(filename)}
+            if not touched:
+                return {"version": current.version, "changed": [], "failed": sorted(self._failed_mtimes)}
+            
+            documents = dict(current.documents)
+            changed = set()
+            for filename in touched:
+                data = self._load_file(filename)
+                if data is None and mtimes[filename] is not None:
+                    # Keep serving the last good copy of a file that failed to parse
+                    self._failed_mtimes[filename] = mtimes[filename]
+                    mtimes[filename] = current.mtimes.get(filename)
+                    continue
+                self._failed_mtimes.pop(filename, None)
+                if data is None:
+                    if documents.pop(filename, None) is not None:
+                        changed.add(filename)
+                elif data != documents.get(filename):
+                    documents[filename] = data
+                    changed.add(filename)
+            
+            # Only a content change gets a new version (and invalidates cached answers);
+            # a file saved without edits just has its mtime recorded
+            version = current.version + 1 if changed else current.version
+            self.snapshot = KnowledgeSnapshot(documents, mtimes, version, current, changed)
+            return {"version": version, "changed": sorted(changed), "failed": sorted(self._failed_mtimes)}
+    
+    def start_watching(self, interval: float = 5.0):
+        """Poll knowledge_dir in a daemon thread and reload on mtime changes"""
+        if self._watcher is not None:
+            return
+        self._stop_watching.clear()
         
-        relevant_files = file_mapping.get(category, list(self.cache.keys()))
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    result = self.reload()
+                    if result["changed"]:
+                        print(f"Reloaded knowledge v{result['version']}: {', '.join(result['changed'])}")
+                except Exception as e:
+                    print(f"Error reloading knowledge: {e}")
         
-        results = {}
-        for filename in relevant_files:
-            if filename in self.cache:
-                results[filename] = self.cache[filename]
+        self._watcher = threading.Thread(target=watch, name="knowledge-watcher", daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        """Stop the background watcher thread"""
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+    
+    def dense_ready(self) -> bool:
+        """True when persisted embeddings match the currently loaded chunks"""
+        return self.dense is not None and self.dense.fingerprint == self.index.fingerprint
+    
+    def suggest_category(self, query: str, top_k: int = 5) -> Optional[str]:
+        """Category whose files hold most of the query's nearest chunks"""
+        if not self.dense_ready():
+            return None
+        index = self.index
+        file_categories = {name: category for category, names in self.FILE_MAPPING.items() for name in names}
+        votes = {}
+        for chunk_id, similarity in self.dense.search(query, None, top_k):
+            category = file_categories.get(index.files[chunk_id])
+            if category and similarity > 0:
+                votes[category] = votes.get(category, 0.0) + similarity
+        return max(votes, key=votes.get) if votes else None
+    
+    def document(self, filename: str) -> Dict[str, Any]:
+        """Return a whole parsed knowledge file (empty if it could not be loaded)"""
+        return self._ensure_loaded([filename]).documents.get(filename, {})
+    
+    def retrieve(self, category: str, query: str, top_k: Optional[int] = None) -> Dict[str, Any]:
+        """Retrieve the top-k knowledge passages for a query, keyed by JSON-pointer path"""
+        return self.retrieve_many(category, [query], top_k)[0]
+    
+    def retrieve_many(self, category: str, queries: List[str], top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Retrieve passages for several queries of one category from a single snapshot"""
+        relevant_files = self.FILE_MAPPING.get(category)
+        top_k = top_k or self.top_k
+        index = self._ensure_loaded(relevant_files or self.JSON_FILES).index
+        if not self.dense_ready():
+            results = index.search_many(queries, relevant_files, top_k)
+            return [{path: value for path, value, score in passages} for passages in results]
         
-        return results
+        # Hybrid: fuse the BM25 and dense rankings with reciprocal rank fusion
+        ids = {path: chunk_id for chunk_id, path in enumerate(index.paths)}
+        lexical = index.search_many(queries, relevant_files, top_k * 2)
+        fused_results = []
+        for query, passages in zip(queries, lexical):
+            fused = {}
+            for rank, (path, value, score) in enumerate(passages):
+                fused[ids[path]] = fused.get(ids[path], 0.0) + 1.0 / (self.RRF_K + rank)
+            for rank, (chunk_id, similarity) in enumerate(self.dense.search(query, relevant_files, top_k * 2)):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (self.RRF_K + rank)
+            best = heapq.nlargest(top_k, fused.items(), key=lambda item: item[1])
+            fused_results.append({index.paths[chunk_id]: index.values[chunk_id] for chunk_id, score in best})
+        return fused_results
+
+
+@functools.lru_cache(maxsize=65536)
+def count_tokens(text: str) -> int:
+    """Approximate LLM token count of a text, memoized for repeated fragments
+    
+    Counts words, numbers and punctuation marks, splitting long words into
+    four-character pieces, which tracks BPE tokenizers closely enough for
+    budgeting without a model-specific dependency.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in re.findall(r"\w+|[^\w\s]", text))
+
+
+class ContextPacker:
+    """Packs ranked knowledge passages into a bounded prompt context
+    
+    Passages are taken in retrieval rank order, near-duplicates (the same fact
+    repeated across files) are dropped, each is compacted to one
+    ``key path: value`` line and lines are added until the token budget is spent.
+    """
+    
+    def __init__(self, token_budget: int = 1500):
+        self.token_budget = token_budget
+    
+    @staticmethod
+    def compact(path: str, value: Any) -> Tuple[str, str]:
+        """Render a passage as a short line plus the key used to spot duplicates"""
+        pointer = path.split("#", 1)[-1]
+        keys = [part.replace("~1", "/").replace("~0", "~") for part in pointer.split("/") if part and not part.isdigit()]
+        label = " > ".join(keys[-3:]) if keys else path
+        dedupe_key = normalize_text(" ".join(keys[-2:]).replace("_students", "")) + "=" + normalize_text(value)
+        return f"- {label}: {value}", dedupe_key
+    
+    def pack(self, knowledge: Dict[str, Any]) -> List[str]:
+        """Return the context lines that fit the budget, best-ranked first"""
+        lines = []
+        seen = set()
+        used = 0
+        for path, value in knowledge.items():
+            line, dedupe_key = self.compact(path, value)
+            if dedupe_key in seen:
+                continue
+            cost = count_tokens(line)
+            if used + cost > self.token_budget:
+                continue
+            seen.add(dedupe_key)
+            lines.append(line)
+            used += cost
+        return lines
 
 
 class ResponseGeneratorAgent:
     """Generates natural language responses from retrieved knowledge"""
     
-    def __init__(self, llm_provider: str = "groq"):
+    PROMPT_TEMPLATE = (
+        "You are the USIU-Africa student support assistant. Answer the question "
+        "using only the context below. If the context does not contain the answer, "
+        "say so and point the student to the relevant office.\n\n"
+        "Context ({category}):\n{context}\n\n"
+        "Question: {query}\n"
+        "Answer:"
+    )
+    
+    def __init__(self, llm_provider: str = "groq", retriever: Optional[KnowledgeRetrieverAgent] = None,
+                 context_token_budget: int = 1500):
         self.llm_provider = llm_provider
+        self.retriever = retriever
+        self.packer = ContextPacker(context_token_budget)
+        self.analyzer = None
+    
+    def _document(self, filename: str) -> Dict[str, Any]:
+        """Whole knowledge file for handlers that read structured records"""
+        if self.retriever is None:
+            return {}
+        return self.retriever.document(filename)
+    
+    def analyze(self, query: str) -> QueryContext:
+        """Analysis for callers that did not run the router's pass themselves"""
+        if self.analyzer is None:
+            self.analyzer = QueryAnalyzer(QueryRouterAgent.CATEGORIES)
+        return self.analyzer.analyze(query, self.retriever.lexicon if self.retriever is not None else None)
     
-    def generate(self, query: str, knowledge: Dict[str, Any], category: str) -> str:
+    def generate(self, query: str, knowledge: Dict[str, Any], category: str,
+                 context: Optional[QueryContext] = None) -> str:
         """Generate response from knowledge"""
         
-        # Simple rule-based response for reliable operation
-        if not knowledge:
+        # Simple rule-based response for reliable operation. Vague queries may
+        # match no passages, so only fall back when nothing is loaded at all.
+        if not knowledge and (self.retriever is None or not self.retriever.cache):
             return self._generate_fallback(query)
         
-        # Extract relevant information based on category
+        # Extract relevant information based on category and detected intents
+        context = context or self.analyze(query)
         if category == "fees_financial":
-            return self._generate_fees_response(query, knowledge)
+            return self._generate_fees_response(context, knowledge)
         elif category == "academic":
-            return self._generate_academic_response(query, knowledge)
+            return self._generate_academic_response(context, knowledge)
         elif category == "facilities":
-            return self._generate_facilities_response(query, knowledge)
+            return self._generate_facilities_response(context, knowledge)
         elif category == "services":
-            return self._generate_services_response(query, knowledge)
+            return self._generate_services_response(context, knowledge)
         elif category == "conduct":
-            return self._generate_conduct_response(query, knowledge)
+            return self._generate_conduct_response(context, knowledge)
         else:
-            return self._generate_general_response(query, knowledge)
+            return self._generate_general_response(context, knowledge)
+    
+    def build_prompt(self, query: str, knowledge: Dict[str, Any], category: str) -> str:
+        """Assemble an LLM prompt whose context stays within the token budget"""
+        context = "\n".join(self.packer.pack(knowledge)) or "(no relevant knowledge found)"
+        return self.PROMPT_TEMPLATE.format(category=category.replace("_", " "), context=context, query=query)
+    
+    def generate_stream(self, query: str, knowledge: Dict[str, Any], category: str,
+                        context: Optional[QueryContext] = None) -> Iterator[str]:
+        """Yield the response in chunks
+        
+        The rule-based answers are built at once and split by line; a backend
+        that produces text incrementally should override this to yield tokens
+        as they arrive.
+        """
+        yield from self.generate(query, knowledge, category, context).splitlines(keepends=True)
     
-    def _generate_fees_response(self, query: str, knowledge: Dict) -> str:
+    def _generate_fees_response(self, context: QueryContext, knowledge: Dict) -> str:
         """Generate response for fees/financial queries"""
-        query_lower = query.lower()
         
         # Check for specific program queries
-        programs_to_check = {
-            "nursing": "Bachelor of Science in Nursing",
-            "ai": "Artificial Intelligence (AI) & Robotics", 
-            "robotics": "Artificial Intelligence (AI) & Robotics",
-            "mba": "Master of Business Administration",
-            "psychology": "Bachelor of Arts in Psychology"
-        }
-        
-        for key, program in programs_to_check.items():
-            if key in query_lower:
-                # Search in fees data
-                for file_key, data in knowledge.items():
-                    if "programs_fees" in file_key or "fees_financial" in file_key:
-                        return self._extract_program_fees(program, data)
+        if context.programs:
+            return self._format_program_fees(list(context.programs))
         
         # Payment methods query
-        if "pay" in query_lower or "payment" in query_lower or "bank" in query_lower:
-            return self._extract_payment_info(knowledge)
+        if context.has("payment"):
+            return self._extract_payment_info()
         
         # M-Pesa query
-        if "mpesa" in query_lower or "m-pesa" in query_lower:
-            return self._extract_mpesa_info(knowledge)
+        if context.has("mpesa"):
+            return self._extract_mpesa_info()
         
         return "I can help you with information about tuition fees, payment methods, and financial services at USIU-Africa. Please specify which program or service you're interested in."
     
-    def _extract_program_fees(self, program: str, data: Dict) -> str:
-        """Extract fees for a specific program"""
-        # Search through the fee structure
-        for category, programs in data.items():
-            if isinstance(programs, dict):
-                for prog_key, prog_data in programs.items():
-                    if isinstance(prog_data, dict):
-                        if "program" in prog_data or "programs" in prog_data:
-                            program_name = prog_data.get("program") or prog_data.get("programs", [""])[0]
-                            if program.lower() in str(program_name).lower():
-                                fees = prog_data.get("fees_per_semester", {})
-                                if fees:
-                                    kenyan = fees.get("kenyan", {}).get("total", "N/A")
-                                    ea = fees.get("east_african", {}).get("total", "N/A")
-                                    non_ea = fees.get("non_east_african", {}).get("total", "N/A")
-                                    
-                                    return f"**{program_name} Fees (Per Semester):**\n\n" \
-                                           f"- Kenyan Students: KES {kenyan:,}\n" \
-                                           f"- East African Students: KES {ea:,}\n" \
-                                           f"- Non-East African Students: KES {non_ea:,}\n\n" \
-                                           f"Note: Fees include tuition, library, medical, student activity, technology fees, and more."
-        
-        return f"I couldn't find specific fee information for {program}. Please contact the Finance Office at finance@usiu.ac.ke or call +254 730 116 509."
-    
-    def _extract_payment_info(self, knowledge: Dict) -> str:
+    def _format_program_fees(self, programs: List[ProgramFees]) -> str:
+        """Render fee records for one or more programs"""
+        sections = []
+        for record in programs:
+            lines = []
+            for schedule in record.schedules:
+                if len(record.schedules) > 1:
+                    lines.append(f"*{schedule.label}:*")
+                for label, total in [("Kenyan Students", schedule.kenyan),
+                                     ("East African Students", schedule.east_african),
+                                     ("Non-East African Students", schedule.non_east_african)]:
+                    if total is not None:
+                        lines.append(f"- {label}: KES {total:,}")
+                lines.append("")
+            heading = "Per Semester" if len(record.schedules) == 1 else record.level.title()
+            sections.append(f"**{record.program} Fees ({heading}):**\n\n" + "\n".join(lines))
+        
+        return "\n".join(sections) + \
+               "\nNote: Fees include tuition, library, medical, student activity, technology fees, and more."
+    
+    def _extract_payment_info(self) -> str:
         """Extract payment methods information"""
-        for file_key, data in knowledge.items():
-            if "fees_financial" in file_key:
-                if "payment_methods" in data or "banks" in data:
-                    banks_info = data.get("banks", {})
-                    if banks_info:
-                        response = "**Payment Methods at USIU-Africa:**\n\n"
-                        response += "**Bank Deposit Options:**\n"
-                        for bank_name, details in banks_info.items():
-                            if isinstance(details, dict):
-                                response += f"\n• **{bank_name}**\n"
-                                if "account_number" in details:
-                                    response += f"  Account: {details['account_number']}\n"
-                                if "branch" in details:
-                                    response += f"  Branch: {details['branch']}\n"
-                        
-                        response += "\n**M-Pesa:** Business number 516900\n"
-                        response += "\n**Note:** No cash payments accepted in Finance Office."
-                        return response
+        data = self._document("fees_financial_info.json")
+        if "payment_methods" in data or "banks" in data:
+            banks_info = data.get("banks", {})
+            if banks_info:
+                response = "**Payment Methods at USIU-Africa:**\n\n"
+                response += "**Bank Deposit Options:**\n"
+                for bank_name, details in banks_info.items():
+                    if isinstance(details, Mapping):
+                        response += f"\n• **{bank_name}**\n"
+                        if "account_number" in details:
+                            response += f"  Account: {details['account_number']}\n"
+                        if "branch" in details:
+                            response += f"  Branch: {details['branch']}\n"
+                
+                response += "\n**M-Pesa:** Business number 516900\n"
+                response += "\n**Note:** No cash payments accepted in Finance Office."
+                return response
         
         return "For payment information, please contact the Finance Office at finance@usiu.ac.ke or +254 730 116 509."
     
-    def _extract_mpesa_info(self, knowledge: Dict) -> str:
+    def _extract_mpesa_info(self) -> str:
         """Extract M-Pesa payment information"""
         response = "**M-Pesa Payment Instructions:**\n\n"
         response += "1. Go to M-Pesa\n"
@@ -209,12 +1542,11 @@ class ResponseGeneratorAgent:
         
         return response
     
-    def _generate_academic_response(self, query: str, knowledge: Dict) -> str:
+    def _generate_academic_response(self, context: QueryContext, knowledge: Dict) -> str:
         """Generate response for academic queries"""
-        query_lower = query.lower()
         
         # GPA requirements
-        if "gpa" in query_lower:
+        if context.has("gpa"):
             return "**GPA Requirements at USIU-Africa:**\n\n" \
                    "- Undergraduate: Minimum 2.0 GPA\n" \
                    "- Graduate: Minimum 3.0 GPA\n\n" \
@@ -225,13 +1557,11 @@ class ResponseGeneratorAgent:
                    "- Summa Cum Laude: 3.90 - 4.00"
         
         # Programs query
-        if "program" in query_lower:
+        if context.has("programs"):
             programs_list = []
-            for file_key, data in knowledge.items():
-                if "programs.json" in file_key:
-                    if "programs" in data:
-                        for prog in data["programs"]:
-                            programs_list.append(f"- {prog.get('name', 'Unknown')} ({prog.get('total_units', 'N/A')} units)")
+            data = self._document("programs.json")
+            for prog in data.get("programs", []):
+                programs_list.append(f"- {prog.get('name', 'Unknown')} ({prog.get('total_units', 'N/A')} units)")
             
             if programs_list:
                 return "**Available Programs at USIU-Africa:**\n\n" + "\n".join(programs_list[:10]) + \
@@ -239,12 +1569,11 @@ class ResponseGeneratorAgent:
         
         return "For academic information, please contact the Registrar at Ext 782-790 or the Academic Affairs office."
     
-    def _generate_facilities_response(self, query: str, knowledge: Dict) -> str:
+    def _generate_facilities_response(self, context: QueryContext, knowledge: Dict) -> str:
         """Generate response for facilities queries"""
-        query_lower = query.lower()
         
         # Library hours
-        if "library" in query_lower and "hour" in query_lower:
+        if context.has("library") and context.has("hours"):
             return "**Library Hours:**\n\n" \
                    "**During Semester:**\n" \
                    "- Monday-Friday: 8:15 AM - 9:00 PM\n" \
@@ -256,7 +1585,7 @@ class ResponseGeneratorAgent:
                    "Contact: Ext 254/294/371 or asklibrarian@usiu.ac.ke"
         
         # Classroom locations
-        if "where is" in query_lower or "classroom" in query_lower or "building" in query_lower:
+        if context.has("location"):
             return "**Campus Buildings & Locations:**\n\n" \
                    "**Chandaria School of Business:** B1-B5, BS1-BS2, LT1-LT2\n" \
                    "**Science Centre:** SC1-SC9, LT3-LT5, Labs A-K\n" \
@@ -266,7 +1595,7 @@ class ResponseGeneratorAgent:
                    "For specific locations, check your class schedule or ask at the Administration Block."
         
         # Cafeteria
-        if "cafeteria" in query_lower or "meal" in query_lower:
+        if context.has("cafeteria"):
             return "**Cafeteria Hours:**\n\n" \
                    "**Breakfast:** Mon-Sat 7:30-9:30 AM, Sun 9:30 AM-2:00 PM\n" \
                    "**Lunch:** Mon-Sat 12:00-3:00 PM, Sun 12:00-2:00 PM\n" \
@@ -275,12 +1604,11 @@ class ResponseGeneratorAgent:
         
         return "For facilities information, please visit the specific department or call the main office at +254 730 116 290."
     
-    def _generate_services_response(self, query: str, knowledge: Dict) -> str:
+    def _generate_services_response(self, context: QueryContext, knowledge: Dict) -> str:
         """Generate response for services queries"""
-        query_lower = query.lower()
         
         # Counseling
-        if "counsel" in query_lower:
+        if context.has("counseling"):
             return "**Counseling Services:**\n\n" \
                    "Location: Counseling Block (opposite Classrooms I & J)\n" \
                    "Contact: Ext 311/297\n\n" \
@@ -293,7 +1621,7 @@ class ResponseGeneratorAgent:
                    "Walk-in welcome, appointments recommended."
         
         # Health center
-        if "health" in query_lower or "medical" in query_lower:
+        if context.has("health"):
             return "**Health Center:**\n\n" \
                    "Location: Next to Hostels\n" \
                    "Contact: Ext 542/230/229\n\n" \
@@ -303,7 +1631,7 @@ class ResponseGeneratorAgent:
                    "**Services:** Clinical diagnosis, prescriptions, minor surgery, vaccinations, health counseling"
         
         # Scholarship
-        if "scholarship" in query_lower or "financial aid" in query_lower:
+        if context.has("scholarship"):
             return "**Financial Aid Programs:**\n\n" \
                    "**Undergraduate:** Full USIU Scholarship, Alumni Scholarship, Sports Scholarship, CWO, RA\n" \
                    "**Graduate:** MBAS Scholarship, Graduate Assistantship\n" \
@@ -314,12 +1642,11 @@ class ResponseGeneratorAgent:
         
         return "For student services, contact the Student Affairs office at Ext 436 or visit the Administration Block."
     
-    def _generate_conduct_response(self, query: str, knowledge: Dict) -> str:
+    def _generate_conduct_response(self, context: QueryContext, knowledge: Dict) -> str:
         """Generate response for conduct/policy queries"""
-        query_lower = query.lower()
         
         # Alcohol/drugs
-        if "alcohol" in query_lower or "drug" in query_lower or "smoking" in query_lower:
+        if context.has("substances"):
             return "**USIU-Africa Substance Policy:**\n\n" \
                    "**Zero Tolerance Policy:**\n" \
                    "- Campus is alcohol-free and drug-free\n" \
@@ -330,7 +1657,7 @@ class ResponseGeneratorAgent:
                    "Report concerns to Security (Ext 583) or Dean of Students (Ext 187)."
         
         # Sanctions
-        if "sanction" in query_lower or "violation" in query_lower or "discipline" in query_lower:
+        if context.has("sanctions"):
             return "**Disciplinary Sanction Levels:**\n\n" \
                    "1. Warning\n" \
                    "2. Probation Level I\n" \
@@ -347,7 +1674,7 @@ class ResponseGeneratorAgent:
         
         return "For conduct and policy questions, refer to the Student Handbook or contact the Dean of Students at Ext 187."
     
-    def _generate_general_response(self, query: str, knowledge: Dict) -> str:
+    def _generate_general_response(self, context: QueryContext, knowledge: Dict) -> str:
         """Generate general response"""
         return "**USIU-Africa Student Support:**\n\n" \
                "I can help you with information about:\n" \
@@ -372,37 +1699,852 @@ class ResponseGeneratorAgent:
                "Visit www.usiu.ac.ke for more information."
 
 
+class SessionStore:
+    """Per-conversation history with bounded turns, idle TTL and a memory budget
+    
+    Sessions are kept in least-recently-used order; idle sessions expire after
+    ``ttl`` seconds and the oldest sessions are evicted whenever the session
+    count or the approximate byte budget is exceeded.
+    """
+    
+    def __init__(self, max_turns: int = 20, ttl: float = 1800.0, max_sessions: int = 10000,
+                 memory_budget: int = 64 * 1024 * 1024):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self._next_id = 1
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _turn_size(turn: Dict[str, Any]) -> int:
+        """Approximate resident size of one stored turn"""
+        return sys.getsizeof(turn) + sum(sys.getsizeof(value) for value in turn.values())
+    
+    def _drop(self, conversation_id: str):
+        session = self._sessions.pop(conversation_id)
+        self.memory_used -= session["bytes"]
+    
+    def _evict(self, now: float):
+        """Expire idle sessions, then trim LRU sessions to the count and byte limits"""
+        while self._sessions:
+            conversation_id, session = next(iter(self._sessions.items()))
+            expired = now - session["last_access"] > self.ttl
+            over_limit = len(self._sessions) > self.max_sessions or self.memory_used > self.memory_budget
+            if not (expired or over_limit):
+                break
+            self._drop(conversation_id)
+    
+    def append(self, conversation_id: str, turn: Dict[str, Any]):
+        """Record a turn, dropping the session's oldest turn past max_turns"""
+        now = time.monotonic()
+        size = self._turn_size(turn)
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                session = {"turns": deque(), "bytes": 0, "last_access": now}
+                self._sessions[conversation_id] = session
+            else:
+                self._sessions.move_to_end(conversation_id)
+            session["turns"].append((turn, size, self._next_id))
+            self._next_id += 1
+            session["bytes"] += size
+            session["last_access"] = now
+            self.memory_used += size
+            while len(session["turns"]) > self.max_turns:
+                _, dropped, _ = session["turns"].popleft()
+                session["bytes"] -= dropped
+                self.memory_used -= dropped
+            self._evict(now)
+    
+    def get(self, conversation_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the most recent turns of one conversation"""
+        return self.page(conversation_id, limit)[0]
+    
+    def page(self, conversation_id: str, limit: int = 10,
+             before: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Up to ``limit`` turns older than the ``before`` cursor, oldest first, and the cursor for the next page"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(conversation_id)
+            if session is None:
+                return [], None
+            self._sessions.move_to_end(conversation_id)
+            session["last_access"] = now
+            turns = [(turn, turn_id) for turn, _, turn_id in session["turns"] if before is None or turn_id < before]
+        page = turns[-limit:] if limit > 0 else []
+        next_cursor = page[0][1] if page and len(turns) > len(page) else None
+        return [turn for turn, _ in page], next_cursor
+    
+    def stats(self) -> Dict[str, int]:
+        """Session count and approximate bytes held"""
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self.memory_used}
+    
+    def gauges(self) -> List[Tuple[str, str, str, float]]:
+        """Session store state in the (name, type, help, value) form metrics_text renders"""
+        stats = self.stats()
+        return [
+            ("usiu_sessions", "gauge", "Conversations held in the session store", stats["sessions"]),
+            ("usiu_session_bytes", "gauge", "Approximate bytes held by the session store", stats["bytes"])
+        ]
+
+
+class ResponseCache:
+    """LRU cache of pipeline results keyed by the normalized query
+    
+    Entries belong to one knowledge version; the whole cache is dropped as soon
+    as a lookup or insert arrives for a newer version.
+    """
+    
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(query: str) -> str:
+        """Fold case, whitespace and punctuation so trivial variants share an entry"""
+        return normalize_text(query)
+    
+    def _check_version(self, version: int) -> bool:
+        """Drop everything on a newer version; False for a stale caller"""
+        if self.version is None or version > self.version:
+            self._entries.clear()
+            self.version = version
+        return version == self.version
+    
+    def get(self, query: str, version: int) -> Optional[Dict[str, Any]]:
+        """Return the cached result for a query, or None on a miss"""
+        key = self.key(query)
+        with self._lock:
+            result = self._entries.get(key) if self._check_version(version) else None
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+    
+    def put(self, query: str, version: int, result: Dict[str, Any]):
+        """Store a result, evicting the least recently used entry past max_size"""
+        if self.max_size <= 0:
+            return
+        key = self.key(query)
+        with self._lock:
+            # A result computed against an older snapshot is never cached
+            if not self._check_version(version):
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters"""
+        with self._lock:
+            return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits,
+                    "misses": self.misses, "version": self.version}
+
+
+class Counter:
+    """Monotonic counter with label values, rendered in Prometheus text format"""
+    
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, rendered in Prometheus text format
+    
+    ``observe`` is a bisect and two additions under a lock, cheap enough to
+    call several times per query on the hot path.
+    """
+    
+    BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+               0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = format_labels(self.labels + ("le",), label_values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    """Render a Prometheus label set, escaping values"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class PipelineMetrics:
+    """Stage latencies and routing counters for the supervisor pipeline"""
+    
+    def __init__(self):
+        self.stage_latency = Histogram(
+            "usiu_stage_latency_seconds", "Time spent in each pipeline stage", ("stage", "category"))
+        self.routed = Counter("usiu_routed_queries_total", "Queries routed to each category", ("category",))
+        self.fallbacks = Counter(
+            "usiu_routing_fallbacks_total", "Queries no router keyword matched, by where they were sent", ("to",))
+    
+    def render(self, gauges: List[Tuple[str, str, str, float]]) -> str:
+        """Prometheus exposition text; gauges are (name, type, help, value) read at scrape time"""
+        lines = []
+        for metric in (self.stage_latency, self.routed, self.fallbacks):
+            lines.extend(metric.render())
+        for name, kind, help_text, value in gauges:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+class GroupCommitWriter(ABC):
+    """Buffers records in memory and commits them in batches from a background thread
+    
+    ``submit`` only appends to a list, so request threads never wait on disk
+    I/O. A batch is committed once ``batch_size`` records are pending or
+    ``interval`` seconds after the first of them arrived, whichever is first.
+    ``close`` commits whatever is still buffered. Subclasses implement
+    ``_write``.
+    """
+    
+    def __init__(self, batch_size: int = 100, interval: float = 1.0, max_pending: int = 100000):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = []
+        self._first_pending = 0.0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+    
+    def submit(self, record: Dict[str, Any]):
+        """Queue one record without blocking on I/O"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(record)
+            # Wake the writer to start the interval timer or to commit a full batch
+            if len(self._pending) == 1:
+                self._first_pending = time.monotonic()
+                self._cond.notify()
+            elif len(self._pending) >= self.batch_size:
+                self._cond.notify()
+            # Started on first use, so a writer created before a fork runs in the child
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = self._first_pending + self.interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+    
+    def flush(self):
+        """Commit everything buffered so far, in submission order"""
+        with self._write_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                self._write(batch)
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"Error writing {len(batch)} records in {type(self).__name__}: {e}")
+    
+    def close(self):
+        """Stop the background thread and commit the remaining records"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+    
+    @abstractmethod
+    def _write(self, records: List[Dict[str, Any]]):
+        """Persist one batch; an exception marks the whole batch as failed"""
+
+
+class FeedbackLog(GroupCommitWriter):
+    """Append-only JSONL feedback file, one fsync per committed batch
+    
+    Each batch is encoded up front and appended with a single ``os.write`` on
+    an ``O_APPEND`` descriptor, so batches from several worker processes land
+    whole rather than interleaving lines.
+    """
+    
+    def __init__(self, path: str, batch_size: int = 100, interval: float = 1.0):
+        super().__init__(batch_size, interval)
+        self.path = path
+    
+    def _write(self, records: List[Dict[str, Any]]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = os.write(fd, payload)
+            if written != len(payload):
+                raise OSError(f"short write ({written} of {len(payload)} bytes)")
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class HistoryStore(GroupCommitWriter):
+    """Conversation history in a SQLite database shared by every worker process
+    
+    A drop-in replacement for SessionStore: turns are queued in memory and
+    inserted in batches by the writer thread, and the database runs in WAL
+    mode so reads in other workers never wait for a commit. Turns older than
+    ``retention`` seconds are pruned, so neither memory nor the file grows
+    with the number of conversations.
+    """
+    
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS turns ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "conversation_id TEXT NOT NULL, "
+        "timestamp REAL NOT NULL, "
+        "query TEXT NOT NULL, "
+        "category TEXT, "
+        "response TEXT NOT NULL)",
+        # The rowid is implicitly part of this index, so a conversation's turns come back in order
+        "CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id)",
+        "CREATE INDEX IF NOT EXISTS turns_timestamp ON turns (timestamp)"
+    )
+    PRUNE_INTERVAL = 3600.0
+    
+    def __init__(self, path: str, batch_size: int = 100, interval: float = 0.5,
+                 retention: float = 30 * 86400.0):
+        super().__init__(batch_size, interval)
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        self._last_prune = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+        finally:
+            conn.close()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Cap the page cache (in KiB) so each connection stays small
+        conn.execute("PRAGMA cache_size=-2048")
+        return conn
+    
+    def _connection(self) -> sqlite3.Connection:
+        """This thread's connection; a forked worker opens its own"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def append(self, conversation_id: str, turn: Dict[str, Any]):
+        """Queue a turn; it is written with the next batch"""
+        self.submit({
+            "conversation_id": conversation_id,
+            "timestamp": time.time(),
+            "query": turn["query"],
+            "category": turn.get("category"),
+            "response": turn["response"]
+        })
+    
+    def _write(self, records: List[Dict[str, Any]]):
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO turns (conversation_id, timestamp, query, category, response) "
+                "VALUES (:conversation_id, :timestamp, :query, :category, :response)",
+                records
+            )
+        now = time.time()
+        if self.retention > 0 and now - self._last_prune > self.PRUNE_INTERVAL:
+            self._last_prune = now
+            with conn:
+                conn.execute("DELETE FROM turns WHERE timestamp < ?", (now - self.retention,))
+    
+    def get(self, conversation_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the most recent turns of one conversation"""
+        return self.page(conversation_id, limit)[0]
+    
+    def page(self, conversation_id: str, limit: int = 10,
+             before: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Up to ``limit`` turns older than the ``before`` cursor, oldest first, and the cursor for the next page"""
+        if limit <= 0:
+            return [], None
+        # Read-your-writes within this worker: commit the caller's queued turns first
+        if any(record["conversation_id"] == conversation_id for record in list(self._pending)):
+            self.flush()
+        rows = self._connection().execute(
+            "SELECT id, timestamp, query, category, response FROM turns "
+            "WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (conversation_id, before if before is not None else sys.maxsize, limit + 1)
+        ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        turns = [
+            {"query": query, "category": category, "response": response, "timestamp": timestamp}
+            for _, timestamp, query, category, response in reversed(rows[:limit])
+        ]
+        return turns, next_cursor
+    
+    def gauges(self) -> List[Tuple[str, str, str, float]]:
+        """Writer state in the (name, type, help, value) form metrics_text renders"""
+        stats = self.stats()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return [
+            ("usiu_history_pending", "gauge", "Conversation turns waiting to be written", stats["pending"]),
+            ("usiu_history_written_total", "counter", "Conversation turns written to the database", stats["written"]),
+            ("usiu_history_dropped_total", "counter", "Conversation turns dropped because the buffer was full",
+             stats["dropped"]),
+            ("usiu_history_db_bytes", "gauge", "Size of the history database file", size)
+        ]
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution
+    
+    The first caller runs the function; callers arriving while it runs wait
+    and receive the same result (or exception). Nothing is kept afterwards,
+    so this complements the response cache rather than replacing it.
+    """
+    
+    class Call:
+        __slots__ = ("done", "result", "error")
+        
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+    
+    def do(self, key: Any, func) -> Tuple[Any, bool]:
+        """Return (result, shared) where shared is True if another caller computed it"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+            else:
+                self.shared += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+    
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
 class SupervisorAgent:
     """Orchestrates the multi-agent workflow"""
     
-    def __init__(self, knowledge_dir: str = "knowledge"):
-        self.router = QueryRouterAgent()
-        self.retriever = KnowledgeRetrieverAgent(knowledge_dir)
-        self.generator = ResponseGeneratorAgent()
-        self.conversation_history = []
+    def __init__(self, knowledge_dir: str = "knowledge", sessions: Optional[Any] = None,
+                 cache: Optional[ResponseCache] = None, embeddings_dir: Optional[str] = None,
+                 snapshot_path: Optional[str] = None, lazy: bool = False, memory_limit: Optional[int] = None,
+                 compact: bool = False, fanout_workers: int = 4, multi_intent_min_score: int = 1):
+        self.retriever = KnowledgeRetrieverAgent(knowledge_dir, embeddings_dir=embeddings_dir,
+                                                 snapshot_path=snapshot_path, lazy=lazy, memory_limit=memory_limit,
+                                                 compact=compact)
+        self.router = QueryRouterAgent(min_score=multi_intent_min_score, retriever=self.retriever)
+        self.generator = ResponseGeneratorAgent(retriever=self.retriever)
+        self.sessions = sessions or SessionStore()
+        self.cache = cache if cache is not None else ResponseCache()
+        self.metrics = PipelineMetrics()
+        self.flights = SingleFlight()
+        # Answers the parts of compound questions; its own pool, so a part never
+        # waits behind the request that is waiting for it. 0 disables decomposition.
+        self.fanout = None
+        if fanout_workers > 0:
+            self.fanout = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix="fanout")
     
-    def process_query(self, query: str) -> Dict[str, Any]:
-        """Main orchestration logic"""
+    def analyze(self, query: str) -> QueryContext:
+        """Step 0: the one analysis pass shared by routing and generation"""
+        return self.router.analyze(query, self.retriever.lexicon)
+    
+    def _route(self, context: QueryContext) -> str:
+        """Keyword routing; the nearest chunks' category decides queries no keyword matches and ties"""
+        category = self.router.classify(context)
+        if category == "general":
+            category = self._fallback_route(context.query)
+        elif not (context.programs and context.has("cost")):
+            scores = context.category_scores
+            tied = [name for name, score in scores.items() if score == scores.get(category)]
+            if len(tied) > 1:
+                suggestion = self.retriever.suggest_category(context.query)
+                if suggestion in tied:
+                    category = suggestion
+        self.metrics.routed.inc(category)
+        return category
+    
+    def _fallback_route(self, query: str) -> str:
+        suggestion = self.retriever.suggest_category(query)
+        self.metrics.fallbacks.inc("semantic" if suggestion else "general")
+        return suggestion or "general"
+    
+    def _decompose(self, context: QueryContext) -> List[Tuple[str, QueryContext]]:
+        """Parts of a compound question, or an empty list to answer it as a whole"""
+        if self.fanout is None:
+            return []
+        return self.router.decompose(context, self.retriever.lexicon)
+    
+    def _answer_part(self, category: str, context: QueryContext) -> Dict[str, Any]:
+        """Steps 2-3 for one part of a compound question"""
+        self.metrics.routed.inc(category)
+        knowledge = self.retriever.retrieve(category, context.search_text)
+        return dict(self._respond(context, category, knowledge), query=context.query)
+    
+    def _answer_parts(self, parts: List[Tuple[str, QueryContext]]) -> Dict[str, Any]:
+        """Answer every part concurrently and merge them into one response
         
-        # Step 1: Route query
-        category = self.router.route(query)
+        The first part runs on the calling thread; the part whose category
+        scored the most keyword hits names the category of the whole answer.
+        """
+        futures = [self.fanout.submit(self._answer_part, category, context) for category, context in parts[1:]]
+        answers = [self._answer_part(*parts[0])] + [future.result() for future in futures]
+        sources = []
+        for answer in answers:
+            sources.extend(source for source in answer["sources"] if source not in sources)
+        top_category, _ = max(parts, key=lambda part: part[1].category_scores.get(part[0], 0))
+        return {
+            "category": top_category,
+            "response": "\n\n".join(answer["response"].strip() for answer in answers),
+            "sources": sources,
+            "parts": [
+                {"query": answer["query"], "category": answer["category"], "sources": answer["sources"]}
+                for answer in answers
+            ]
+        }
+    
+    def metrics_text(self, extra: Optional[List[Tuple[str, str, str, float]]] = None) -> str:
+        """Render pipeline metrics plus cache, history and knowledge gauges, and any extra ones"""
+        cache = self.cache.stats()
+        return self.metrics.render(list(extra or []) + self.sessions.gauges() + [
+            ("usiu_response_cache_entries", "gauge", "Entries in the response cache", cache["size"]),
+            ("usiu_response_cache_hits_total", "counter", "Response cache hits", cache["hits"]),
+            ("usiu_response_cache_misses_total", "counter", "Response cache misses", cache["misses"]),
+            ("usiu_knowledge_version", "gauge", "Version of the loaded knowledge snapshot", self.retriever.version),
+            ("usiu_singleflight_in_flight", "gauge", "Distinct queries currently being answered", self.flights.in_flight()),
+            ("usiu_singleflight_shared_total", "counter", "Queries answered by joining an identical in-flight query",
+             self.flights.shared)
+        ])
+    
+    def process_query(self, query: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Main orchestration logic"""
+        started = time.perf_counter()
+        answer = self._lookup(query, self.retriever.version)
+        return self._finish(query, answer, conversation_id, started)
+    
+    def _lookup(self, query: str, version: int, context: Optional[QueryContext] = None,
+                parts: Optional[List[Tuple[str, QueryContext]]] = None) -> Dict[str, Any]:
+        """Steps 1-3 behind the response cache; identical in-flight queries share one run"""
+        observe = self.metrics.stage_latency.observe
+        started = time.perf_counter()
+        answer = self.cache.get(query, version)
+        if answer is not None:
+            observe(time.perf_counter() - started, "cache_hit", answer["category"])
+            return answer
         
-        # Step 2: Retrieve knowledge
-        knowledge = self.retriever.retrieve(category, query)
+        # Identical queries arriving while this one runs share its answer
+        answer, shared = self.flights.do(
+            (ResponseCache.key(query), version), lambda: self._answer(query, version, context, parts)
+        )
+        if shared:
+            observe(time.perf_counter() - started, "shared", answer["category"])
+        return answer
+    
+    def _answer(self, query: str, version: int, context: Optional[QueryContext] = None,
+                parts: Optional[List[Tuple[str, QueryContext]]] = None) -> Dict[str, Any]:
+        """Steps 1-3 for a query the cache could not answer, reusing the caller's analysis if given"""
+        observe = self.metrics.stage_latency.observe
+        started = time.perf_counter()
         
-        # Step 3: Generate response
-        response = self.generator.generate(query, knowledge, category)
+        # Step 1: Analyze and route query; compound questions fan out per part
+        if context is None:
+            context = self.analyze(query)
+            parts = self._decompose(context)
+        if parts:
+            mark = time.perf_counter()
+            observe(mark - started, "route", "multi")
+            result = self._answer_parts(parts)
+            observe(time.perf_counter() - mark, "fanout", result["category"])
+        else:
+            category = self._route(context)
+            mark = time.perf_counter()
+            observe(mark - started, "route", category)
+            
+            # Step 2: Retrieve knowledge
+            knowledge = self.retriever.retrieve(category, context.search_text)
+            mark, previous = time.perf_counter(), mark
+            observe(mark - previous, "retrieve", category)
+            
+            # Step 3: Generate response
+            result = self._respond(context, category, knowledge)
+            observe(time.perf_counter() - mark, "generate", category)
         
-        # Step 4: Store in history
-        self.conversation_history.append({
-            "query": query,
+        self.cache.put(query, version, result)
+        return result
+    
+    def _respond(self, context: QueryContext, category: str, knowledge: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 3: generate the answer for retrieved knowledge"""
+        return {
             "category": category,
-            "response": response
-        })
+            "response": self.generator.generate(context.query, knowledge, category, context),
+            "sources": list(knowledge.keys()) if knowledge else []
+        }
+    
+    def _finish(self, query: str, answer: Dict[str, Any], conversation_id: Optional[str] = None,
+                started: Optional[float] = None) -> Dict[str, Any]:
+        """Step 4: store the turn in the caller's history and shape the result"""
+        observe = self.metrics.stage_latency.observe
+        category = answer["category"]
         
-        return {
+        # Anonymous queries are not kept
+        if conversation_id:
+            mark = time.perf_counter()
+            self.sessions.append(conversation_id, {
+                "query": query,
+                "category": category,
+                "response": answer["response"]
+            })
+            observe(time.perf_counter() - mark, "history", category)
+        if started is not None:
+            observe(time.perf_counter() - started, "total", category)
+        
+        result = {
             "query": query,
             "category": category,
-            "response": response,
-            "sources": list(knowledge.keys()) if knowledge else []
+            "response": answer["response"],
+            "sources": list(answer["sources"])
         }
+        if answer.get("parts"):
+            result["parts"] = answer["parts"]
+        return result
+    
+    def stream_query(self, query: str, conversation_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Process a query as a stream of events
+        
+        Yields a ``meta`` event with the category and sources as soon as
+        retrieval is done, then ``chunk`` events from the generator's
+        ``generate_stream``, then ``done``. Cached answers and compound
+        questions go through the same cached, single-flight path as
+        process_query and are streamed line by line.
+        """
+        observe = self.metrics.stage_latency.observe
+        started = time.perf_counter()
+        version = self.retriever.version
+        answer = self.cache.get(query, version)
+        if answer is not None:
+            observe(time.perf_counter() - started, "cache_hit", answer["category"])
+        else:
+            context = self.analyze(query)
+            parts = self._decompose(context)
+            if parts:
+                answer = self._lookup(query, version, context, parts)
+        
+        if answer is not None:
+            meta = {"event": "meta", "category": answer["category"], "sources": list(answer["sources"])}
+            if answer.get("parts"):
+                meta["parts"] = answer["parts"]
+            yield meta
+            for chunk in answer["response"].splitlines(keepends=True):
+                yield {"event": "chunk", "text": chunk}
+        else:
+            # Step 1: Route the analyzed query
+            category = self._route(context)
+            mark = time.perf_counter()
+            observe(mark - started, "route", category)
+            
+            # Step 2: Retrieve knowledge
+            knowledge = self.retriever.retrieve(category, context.search_text)
+            sources = list(knowledge.keys()) if knowledge else []
+            observe(time.perf_counter() - mark, "retrieve", category)
+            yield {"event": "meta", "category": category, "sources": list(sources)}
+            
+            # Step 3: Generate response incrementally; the time spent waiting on the client is not counted
+            chunks = self.generator.generate_stream(query, knowledge, category, context)
+            text = []
+            generating = 0.0
+            while True:
+                mark = time.perf_counter()
+                chunk = next(chunks, None)
+                generating += time.perf_counter() - mark
+                if chunk is None:
+                    break
+                text.append(chunk)
+                yield {"event": "chunk", "text": chunk}
+            observe(generating, "generate", category)
+            answer = {"category": category, "response": "".join(text), "sources": sources}
+            self.cache.put(query, version, answer)
+        
+        # Step 4: Store in the caller's history
+        self._finish(query, answer, conversation_id, started)
+        yield {"event": "done"}
+    
+    def process_batch(self, queries: List[str], conversation_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Answer many queries at once, returning results in input order
+        
+        Cached and duplicate queries are answered once; the rest are routed
+        together and grouped by category so each category's retrieval runs
+        against one snapshot and one file subset.
+        """
+        version = self.retriever.version
+        answers = {}
+        pending = {}
+        for query in queries:
+            key = ResponseCache.key(query)
+            if key in answers or key in pending:
+                continue
+            cached = self.cache.get(query, version)
+            if cached is not None:
+                answers[key] = cached
+            else:
+                pending[key] = query
+        
+        # Step 1: Analyze and route all outstanding queries together
+        by_category = {}
+        observe = self.metrics.stage_latency.observe
+        mark = time.perf_counter()
+        for key, query in pending.items():
+            context = self.analyze(query)
+            parts = self._decompose(context)
+            if parts:
+                answers[key] = self._answer_parts(parts)
+                self.cache.put(query, version, answers[key])
+            else:
+                by_category.setdefault(self._route(context), []).append(context)
+        observe(time.perf_counter() - mark, "batch_route", "all")
+        
+        for category, contexts in by_category.items():
+            # Step 2: Retrieve knowledge once per category
+            mark = time.perf_counter()
+            knowledge_list = self.retriever.retrieve_many(category, [context.search_text for context in contexts])
+            observe(time.perf_counter() - mark, "batch_retrieve", category)
+            
+            # Step 3: Generate responses
+            for context, knowledge in zip(contexts, knowledge_list):
+                result = self._respond(context, category, knowledge)
+                self.cache.put(context.query, version, result)
+                answers[ResponseCache.key(context.query)] = result
+        
+        # Step 4: Store in the caller's history
+        return [self._finish(query, answers[ResponseCache.key(query)], conversation_id) for query in queries]
+    
+    def get_history(self, conversation_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Return the most recent turns of one conversation"""
+        return self.sessions.get(conversation_id, limit)
+    
+    def get_history_page(self, conversation_id: str, limit: int = 10,
+                         before: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """Return one page of a conversation's turns and the cursor for the older page"""
+        return self.sessions.page(conversation_id, limit, before)
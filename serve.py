@@ -0,0 +1,98 @@
+"""
+Multi-Worker Server - Load and index the knowledge once, then fork API workers
+Workers share the parent's parsed knowledge copy-on-write (Linux/macOS)
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def run_worker(app, sock: socket.socket):
+    """Serve the already-built app on the inherited listening socket"""
+    import uvicorn
+    
+    gc.enable()
+    config = uvicorn.Config(app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the USIU chatbot API with preforked workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    args = parser.parse_args()
+    
+    # No collections while the knowledge is being built, so nothing is left in
+    # the young generations for a child's first collection to rewrite
+    gc.disable()
+    from backend.api import app, supervisor
+    
+    if supervisor is None:
+        print("❌ Supervisor agent failed to initialize")
+        sys.exit(1)
+    
+    # Move every object built so far into the permanent generation; the
+    # collector never touches their headers, so their pages stay shared
+    gc.freeze()
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"🚀 Serving on http://{args.host}:{args.port} with {args.workers} workers")
+    
+    workers = set()
+    stopping = False
+    
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(app, sock)
+            finally:
+                os._exit(0)
+        workers.add(pid)
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        # Ctrl+C already reached the workers through the process group
+        if signum != signal.SIGINT:
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        spawn()
+    
+    # Replace workers that die unexpectedly until asked to stop
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"⚠️ Worker {pid} exited with status {status}; starting a replacement")
+            spawn()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
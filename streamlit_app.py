@@ -5,8 +5,12 @@ Clean, user-friendly interface
 
 import streamlit as st
 import requests
+import json
+import re
 import time
-from typing import Dict, Any
+import uuid
+from typing import Dict, Any, Iterator, Optional, Tuple
+from requests.adapters import HTTPAdapter
 
 # Page configuration
 st.set_page_config(
@@ -19,6 +23,110 @@ st.set_page_config(
 # API Configuration
 API_URL = "http://localhost:8000"
 
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One keep-alive connection pool shared by every script rerun and browser session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_health() -> Tuple[int, Dict[str, Any]]:
+    """Status code and body of /health; failures raise and are not cached"""
+    response = get_http_session().get(f"{API_URL}/health", timeout=5)
+    return response.status_code, response.json() if response.status_code == 200 else {}
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_categories() -> list:
+    """Categories the router knows about"""
+    response = get_http_session().get(f"{API_URL}/categories", timeout=5)
+    response.raise_for_status()
+    return response.json().get("categories", [])
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def find_previous_answer(question: str) -> Optional[Dict[str, Any]]:
+    """Most recent successful answer to the same question in this conversation"""
+    key = normalize_question(question)
+    messages = st.session_state.messages
+    for i in range(len(messages) - 2, -1, -1):
+        message, reply = messages[i], messages[i + 1]
+        if (message["role"] == "user" and reply["role"] == "assistant" and "metadata" in reply
+                and normalize_question(message["content"]) == key):
+            return reply
+    return None
+
+
+def render_category_badges(metadata: Dict[str, Any]):
+    """One badge per category answered; compound questions list each part's category"""
+    categories = [part["category"] for part in metadata.get("parts") or []] or [metadata.get("category", "general")]
+    st.markdown(
+        " ".join(
+            f'<span class="category-badge">📂 {category.replace("_", " ").title()}</span>'
+            for category in categories
+        ),
+        unsafe_allow_html=True
+    )
+
+
+def render_feedback(index: int, message: Dict[str, Any], question: Optional[str]):
+    """Thumbs up/down for one answer, sent to the API's feedback log"""
+    if "feedback" in message:
+        st.caption("👍 Thanks for your feedback!" if message["feedback"] == "up" else "👎 Thanks, we'll work on improving!")
+        return
+    
+    col1, col2, col3 = st.columns([1, 1, 4])
+    rating = None
+    with col1:
+        if st.button("👍", key=f"thumbs_up_{index}"):
+            rating = "up"
+    with col2:
+        if st.button("👎", key=f"thumbs_down_{index}"):
+            rating = "down"
+    if rating is None:
+        return
+    
+    message["feedback"] = rating
+    try:
+        get_http_session().post(
+            f"{API_URL}/feedback",
+            json={
+                "rating": rating,
+                "question": question,
+                "answer": message["content"],
+                "category": message["metadata"].get("category"),
+                "conversation_id": st.session_state.conversation_id
+            },
+            timeout=5
+        )
+    except requests.exceptions.RequestException:
+        pass
+    st.toast("Thanks for your feedback!" if rating == "up" else "We'll work on improving!")
+
+
+def iter_sse(response: requests.Response) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Parse a server-sent-events response into (event, data) pairs"""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 # Custom CSS for better appearance
 st.markdown("""
 <style>
@@ -56,6 +164,9 @@ st.markdown("""
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if "conversation_id" not in st.session_state:
+    st.session_state.conversation_id = str(uuid.uuid4())
+
 if "api_status" not in st.session_state:
     st.session_state.api_status = "unknown"
 
@@ -81,13 +192,13 @@ with st.sidebar:
     # API Status Check
     if st.button("🔄 Check API Status"):
         try:
-            response = requests.get(f"{API_URL}/health", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
+            status_code, data = fetch_health()
+            if status_code == 200:
                 st.session_state.api_status = "online"
                 st.success("✅ API is online")
                 with st.expander("API Details"):
                     st.json(data)
+                    st.write("Categories: " + ", ".join(fetch_categories()))
             else:
                 st.session_state.api_status = "error"
                 st.error("❌ API returned an error")
@@ -119,82 +230,117 @@ with st.sidebar:
     
     if st.button("🗑️ Clear Chat"):
         st.session_state.messages = []
+        st.session_state.conversation_id = str(uuid.uuid4())
         st.rerun()
 
 # Display chat messages
-for message in st.session_state.messages:
+for index, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         
         # Display category badge for assistant messages
         if message["role"] == "assistant" and "metadata" in message:
-            category = message["metadata"].get("category", "general")
-            st.markdown(
-                f'<span class="category-badge">📂 {category.replace("_", " ").title()}</span>',
-                unsafe_allow_html=True
-            )
+            render_category_badges(message["metadata"])
+            question = st.session_state.messages[index - 1]["content"] if index > 0 else None
+            render_feedback(index, message, question)
 
 # Chat input
 user_input = st.chat_input("Ask me anything about USIU-Africa...")
 
 if user_input:
+    previous_answer = find_previous_answer(user_input)
+    
     # Add user message
     st.session_state.messages.append({"role": "user", "content": user_input})
     
     # Display user message
     with st.chat_message("user"):
         st.markdown(user_input)
-    
+
+# Repeated question: answer from this conversation without calling the API
+if user_input and previous_answer is not None:
+    with st.chat_message("assistant"):
+        st.markdown(previous_answer["content"])
+        render_category_badges(previous_answer["metadata"])
+        st.caption("↩️ Answered earlier in this conversation")
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": previous_answer["content"],
+            "metadata": dict(previous_answer["metadata"])
+        })
+        render_feedback(len(st.session_state.messages) - 1, st.session_state.messages[-1], user_input)
+
+elif user_input:
     # Get assistant response
     with st.chat_message("assistant"):
         with st.spinner("🤔 Thinking..."):
             try:
-                # Call API
-                response = requests.post(
-                    f"{API_URL}/chat",
-                    json={"question": user_input},
-                    timeout=30
+                # Call the streaming API; the read timeout applies between
+                # chunks, so long answers are not cut off
+                response = get_http_session().post(
+                    f"{API_URL}/chat/stream",
+                    json={
+                        "question": user_input,
+                        "conversation_id": st.session_state.conversation_id
+                    },
+                    stream=True,
+                    timeout=(5, 30)
                 )
                 
                 if response.status_code == 200:
-                    data = response.json()
-                    answer = data["answer"]
-                    category = data.get("category", "general")
-                    sources = data.get("sources", [])
+                    answer = ""
+                    category = "general"
+                    sources = []
+                    parts = []
+                    answer_placeholder = st.empty()
                     
-                    # Display answer
-                    st.markdown(answer)
+                    # Render the answer as chunks arrive
+                    for event, data in iter_sse(response):
+                        if event == "meta":
+                            category = data.get("category", "general")
+                            sources = data.get("sources", [])
+                            parts = data.get("parts", [])
+                        elif event == "chunk":
+                            answer += data["text"]
+                            answer_placeholder.markdown(answer + "▌")
+                        elif event == "error":
+                            raise RuntimeError(data.get("detail", "stream failed"))
+                    answer_placeholder.markdown(answer)
                     
                     # Display metadata
-                    st.markdown(
-                        f'<span class="category-badge">📂 {category.replace("_", " ").title()}</span>',
-                        unsafe_allow_html=True
-                    )
+                    metadata = {"category": category, "sources": sources}
+                    if parts:
+                        metadata["parts"] = parts
+                    render_category_badges(metadata)
                     
                     # Show sources if available
                     if sources:
                         with st.expander("📚 Knowledge Sources"):
-                            for source in sources:
-                                st.write(f"- {source}")
+                            for part in parts or [{"sources": sources}]:
+                                if "query" in part:
+                                    st.markdown(f"**{part['query']}**")
+                                for source in part["sources"]:
+                                    st.write(f"- {source}")
                     
                     # Save assistant message with metadata
                     st.session_state.messages.append({
                         "role": "assistant",
                         "content": answer,
-                        "metadata": {
-                            "category": category,
-                            "sources": sources
-                        }
+                        "metadata": metadata
                     })
                     
-                    # Feedback buttons
-                    col1, col2, col3 = st.columns([1, 1, 4])
-                    with col1:
-                        if st.button("👍", key=f"thumbs_up_{len(st.session_state.messages)}"):
-                            st.toast("Thanks for your feedback!")
-                    with col2:
-                        if st.button("👎", key=f"thumbs_down_{len(st.session_state.messages)}"):
-                            st.toast("We'll work on improving!")
+                    # Feedback buttons; keyed by message index so the history loop
+                    # renders the same buttons after the click reruns the script
+                    render_feedback(len(st.session_state.messages) - 1, st.session_state.messages[-1], user_input)
+                
+                elif response.status_code == 503:
+                    retry_after = response.headers.get("Retry-After", "a few")
+                    error_msg = f"⏳ The server is busy right now. Please try again in {retry_after} second(s)."
+                    st.warning(error_msg)
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": error_msg
+                    })
                 
                 elif response.status_code == 500:
                     error_msg = "⚠️ The server encountered an error. Please try again or rephrase your question."
@@ -0,0 +1,31 @@
+"""
+Tests for the benchmark suite's statistics
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmark import percentile
+
+
+@pytest.mark.parametrize("count, fraction, expected", [
+    (10, 0.50, 5),
+    (22, 0.50, 11),
+    (100, 0.95, 95),
+    (100, 0.99, 99),
+    (7, 0.50, 4),
+    (3, 0.99, 3),
+    (1, 0.50, 1)
+])
+def test_percentile_is_nearest_rank(count, fraction, expected):
+    assert percentile([float(i) for i in range(1, count + 1)], fraction) == expected
+
+
+def test_percentile_of_no_samples():
+    assert percentile([], 0.5) == 0.0
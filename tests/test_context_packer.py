@@ -0,0 +1,46 @@
+"""
+Tests for packing retrieved passages into a prompt context
+"""
+
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import ContextPacker, ResponseGeneratorAgent, SupervisorAgent, count_tokens
+
+
+def test_pack_stays_within_token_budget():
+    knowledge = {f"programs.json#/programs/{i}/description": "word " * 20 for i in range(50)}
+    packer = ContextPacker(token_budget=100)
+    lines = packer.pack(knowledge)
+    assert lines
+    assert sum(count_tokens(line) for line in lines) <= 100
+    assert len(lines) < len(knowledge)
+
+
+def test_pack_drops_facts_repeated_across_files():
+    knowledge = {
+        "fees_financial_info.json#/fee_schedules/bsc_nursing/fees_per_semester/kenyan_students/total": 383450,
+        "all_programs_fees_2025_2026.json#/undergraduate_programs/nursing/fees_per_semester/kenyan/total": 383450,
+        "campus_facilities_services.json#/campus_locations/library/name": "Library"
+    }
+    lines = ContextPacker().pack(knowledge)
+    assert len(lines) == 2
+    assert lines[0].endswith(": 383450")
+
+
+def test_build_prompt_packs_retrieved_knowledge():
+    supervisor = SupervisorAgent(knowledge_dir=str(project_root / "knowledge"))
+    query = "What are the fees for nursing?"
+    knowledge = supervisor.retriever.retrieve("fees_financial", query)
+    generator = ResponseGeneratorAgent(retriever=supervisor.retriever, context_token_budget=60)
+    
+    prompt = generator.build_prompt(query, knowledge, "fees_financial")
+    context = prompt.split("Context (fees financial):\n", 1)[1].split("\n\nQuestion:", 1)[0]
+    assert prompt.endswith(f"Question: {query}\nAnswer:")
+    assert 0 < sum(count_tokens(line) for line in context.splitlines()) <= 60
+    
+    assert "(no relevant knowledge found)" in generator.build_prompt(query, {}, "general")
@@ -0,0 +1,39 @@
+"""
+Tests for the program fee index
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import KnowledgeRetrieverAgent
+
+
+@pytest.fixture(scope="module")
+def fees():
+    return KnowledgeRetrieverAgent(str(project_root / "knowledge")).fees
+
+
+def programs(fees, query):
+    return [record.program for record in fees.find(query)]
+
+
+def test_online_program_borrows_acronym_of_same_level(fees):
+    assert programs(fees, "online mba") == ["Online Master of Business Administration"]
+
+
+def test_online_acronym_without_online_program_matches_nothing(fees):
+    # DBA and MBA share a subject; the Online MBA must not answer to "online dba"
+    assert programs(fees, "online dba") == []
+    assert programs(fees, "fees for online DBA") == []
+    assert programs(fees, "online dir") == []
+
+
+def test_on_campus_acronyms_still_match(fees):
+    assert programs(fees, "dba") == ["Doctor of Business Administration (DBA)"]
+    assert programs(fees, "mba") == ["Master of Business Administration (MBA)"]
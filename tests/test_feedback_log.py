@@ -0,0 +1,56 @@
+"""
+Tests for the group-committed feedback log
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import FeedbackLog, GroupCommitWriter
+
+
+def test_close_writes_buffered_records(tmp_path):
+    log = FeedbackLog(str(tmp_path / "feedback.jsonl"), batch_size=100, interval=60)
+    for i in range(3):
+        log.submit({"rating": "up", "question": f"q{i}"})
+    log.close()
+    lines = (tmp_path / "feedback.jsonl").read_text().splitlines()
+    assert [json.loads(line)["question"] for line in lines] == ["q0", "q1", "q2"]
+    assert log.stats()["written"] == 3
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_batches_from_several_processes_do_not_interleave(tmp_path):
+    path = str(tmp_path / "feedback.jsonl")
+    workers, records = 4, 400
+    pids = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Batches well past the 8 KiB buffer a text-mode write would split
+            log = FeedbackLog(path, batch_size=200, interval=60)
+            for i in range(records):
+                log.submit({"rating": "up", "worker": worker, "i": i, "comment": "x" * 200})
+            log.close()
+            os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    
+    lines = Path(path).read_text().splitlines()
+    assert len(lines) == workers * records
+    seen = [json.loads(line) for line in lines]
+    for worker in range(workers):
+        assert [record["i"] for record in seen if record["worker"] == worker] == list(range(records))
+
+
+def test_writer_requires_a_sink():
+    with pytest.raises(TypeError):
+        GroupCommitWriter()
@@ -0,0 +1,44 @@
+"""
+Tests for the keyword matcher and keyword routing
+"""
+
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import KeywordMatcher, KnowledgeRetrieverAgent, QueryRouterAgent
+
+
+def test_keywords_match_whole_words_only():
+    matcher = KeywordMatcher({"tech": ["ai"], "fees": ["pay"]})
+    assert matcher.find("she said so") == []
+    assert matcher.find("how do i repay my loan") == []
+    assert matcher.find("ai courses and how to pay") == ["ai", "pay"]
+
+
+def test_keywords_match_simple_inflections():
+    matcher = KeywordMatcher({"fees": ["fee", "pay"]})
+    assert matcher.find("fees and paying") == ["fee", "pay"]
+    assert matcher.find("feel") == []
+
+
+def test_score_counts_distinct_keywords_per_group():
+    matcher = KeywordMatcher({"fees": ["fee", "cost"], "facilities": ["library"]})
+    assert matcher.score("fee fees cost of the library") == {"fees": 2, "facilities": 1}
+
+
+def test_mpesa_and_paybill_route_to_fees():
+    router = QueryRouterAgent()
+    for query in ["M-Pesa paybill number", "What is the paybill?", "pay via m pesa"]:
+        assert router.route(query) == "fees_financial"
+
+
+def test_router_with_a_retriever_corrects_spelling():
+    retriever = KnowledgeRetrieverAgent(str(project_root / "knowledge"))
+    assert QueryRouterAgent().route("libary hours") == "general"
+    router = QueryRouterAgent(retriever=retriever)
+    assert router.route("libary hours") == "facilities"
+    assert router.route_many(["libary hours", "how much is tution"]) == ["facilities", "fees_financial"]
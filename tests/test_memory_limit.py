@@ -0,0 +1,32 @@
+"""
+Tests for lazy loading under a memory limit
+"""
+
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import KnowledgeRetrieverAgent, KnowledgeSnapshot
+
+QUERIES = [
+    ("facilities", "What are the library hours?"),
+    ("fees_financial", "How much is the nursing degree?"),
+    ("conduct", "What is the dress code?"),
+    ("services", "Tell me about the Mastercard Foundation scholarship"),
+    ("academic", "How do I register for classes?"),
+]
+
+
+def test_lexicon_files_stay_resident_and_are_not_reindexed():
+    retriever = KnowledgeRetrieverAgent(str(project_root / "knowledge"), lazy=True, memory_limit=100_000)
+    fees = retriever.fees
+    for category, query in QUERIES * 2:
+        retriever.retrieve(category, query)
+        assert KnowledgeSnapshot.LEXICON_FILES <= set(retriever.snapshot.documents)
+    
+    # Category files were evicted along the way, but the fee index was never rebuilt
+    assert set(retriever.snapshot.documents) != set(KnowledgeRetrieverAgent.JSON_FILES)
+    assert retriever.fees is fees
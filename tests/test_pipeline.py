@@ -0,0 +1,98 @@
+"""
+Tests for the supervisor's query pipelines
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import SupervisorAgent, ResponseCache
+
+
+@pytest.fixture
+def supervisor():
+    return SupervisorAgent(knowledge_dir=str(project_root / "knowledge"), cache=ResponseCache(max_size=0))
+
+
+def stream(supervisor, query, conversation_id=None):
+    events = list(supervisor.stream_query(query, conversation_id))
+    meta = events[0]
+    assert meta.pop("event") == "meta" and events[-1] == {"event": "done"}
+    return meta, "".join(event["text"] for event in events[1:-1])
+
+
+@pytest.mark.parametrize("query", ["What are the fees for nursing?", "What are the nursing fees and library hours?"])
+def test_stream_matches_process_query(supervisor, query):
+    result = supervisor.process_query(query)
+    meta, text = stream(supervisor, query)
+    assert text == result["response"]
+    assert meta["category"] == result["category"]
+    assert meta["sources"] == result["sources"]
+    assert meta.get("parts") == result.get("parts")
+
+
+def test_stream_records_history_and_total(supervisor):
+    stream(supervisor, "Where is the library?", "c1")
+    assert [turn["query"] for turn in supervisor.get_history("c1")] == ["Where is the library?"]
+    assert 'usiu_stage_latency_seconds_count{stage="total",category="facilities"} 1' in supervisor.metrics_text()
+
+
+def test_stream_sends_meta_before_generating(supervisor):
+    generated = []
+    generate = supervisor.generator.generate
+    
+    def recording_generate(*args):
+        generated.append(args[0])
+        return generate(*args)
+    
+    supervisor.generator.generate = recording_generate
+    events = supervisor.stream_query("Where is the library?")
+    meta = next(events)
+    assert meta["event"] == "meta" and meta["category"] == "facilities" and meta["sources"]
+    assert generated == []
+    assert next(events)["event"] == "chunk"
+    assert generated == ["Where is the library?"]
+
+
+def test_stream_joins_an_identical_in_flight_compound_query(supervisor):
+    query = "What are the nursing fees and library hours?"
+    release = threading.Event()
+    calls = []
+    answer = supervisor._answer
+    
+    def slow_answer(query, *args):
+        calls.append(query)
+        release.wait(5)
+        return answer(query, *args)
+    
+    supervisor._answer = slow_answer
+    threads = [threading.Thread(target=stream, args=(supervisor, query)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while supervisor.flights.in_flight() == 0:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [query]
+    assert supervisor.flights.shared == 1
+
+
+def test_compound_answer_reports_top_scoring_category(supervisor):
+    result = supervisor.process_query("library hours and alcohol policy")
+    assert [part["category"] for part in result["parts"]] == ["facilities", "conduct"]
+    assert result["category"] == "conduct"
+
+
+def test_multi_intent_threshold_is_configurable():
+    supervisor = SupervisorAgent(knowledge_dir=str(project_root / "knowledge"), multi_intent_min_score=2)
+    result = supervisor.process_query("library hours and alcohol policy")
+    assert "parts" not in result
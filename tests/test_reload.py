@@ -0,0 +1,52 @@
+"""
+Tests for hot-reloading knowledge files
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import KnowledgeRetrieverAgent
+
+FILENAME = "campus_facilities_services.json"
+
+
+def write(path: Path, text: str, mtime: float):
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_unparseable_file_is_not_reloaded_on_every_poll(tmp_path):
+    path = tmp_path / FILENAME
+    write(path, json.dumps({"library": {"name": "Library"}}), 1000)
+    retriever = KnowledgeRetrieverAgent(str(tmp_path))
+    version = retriever.version
+    
+    write(path, "{not json", 2000)
+    first = retriever.reload()
+    second = retriever.reload()
+    assert first["changed"] == [] and first["failed"] == [FILENAME]
+    assert second["version"] == version
+    assert retriever.document(FILENAME) == {"library": {"name": "Library"}}
+    
+    write(path, json.dumps({"library": {"name": "Main Library"}}), 3000)
+    result = retriever.reload()
+    assert result["changed"] == [FILENAME] and result["failed"] == []
+    assert result["version"] == version + 1
+
+
+def test_saving_without_edits_keeps_the_version(tmp_path):
+    path = tmp_path / FILENAME
+    write(path, json.dumps({"library": {"name": "Library"}}), 1000)
+    retriever = KnowledgeRetrieverAgent(str(tmp_path))
+    version = retriever.version
+    
+    write(path, json.dumps({"library": {"name": "Library"}}, indent=2), 2000)
+    assert retriever.reload() == {"version": version, "changed": [], "failed": []}
+    # The new mtime was recorded, so the file is not read again
+    assert retriever.snapshot.mtimes[FILENAME] == 2000
@@ -0,0 +1,44 @@
+"""
+Tests for routing with the dense chunk index
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from src.agents.multi_agent_system import DenseIndex, HashingEncoder, KnowledgeRetrieverAgent, SupervisorAgent
+
+KNOWLEDGE_DIR = str(project_root / "knowledge")
+
+
+@pytest.fixture(scope="module")
+def supervisor(tmp_path_factory):
+    embeddings_dir = str(tmp_path_factory.mktemp("embeddings"))
+    DenseIndex.build(KnowledgeRetrieverAgent(KNOWLEDGE_DIR).index, HashingEncoder(), embeddings_dir)
+    supervisor = SupervisorAgent(knowledge_dir=KNOWLEDGE_DIR, embeddings_dir=embeddings_dir)
+    assert supervisor.retriever.dense_ready()
+    return supervisor
+
+
+def test_price_of_a_named_program_gets_the_fee_answer(supervisor):
+    result = supervisor.process_query("how much is the nursing degree")
+    assert result["category"] == "fees_financial"
+    assert "Nursing Fees" in result["response"]
+
+
+def test_program_questions_without_a_price_stay_academic(supervisor):
+    assert supervisor.process_query("tell me about the nursing degree")["category"] == "academic"
+
+
+def test_dense_vote_breaks_keyword_ties(supervisor, monkeypatch):
+    context = supervisor.analyze("library rules")
+    assert context.category_scores == {"facilities": 1, "conduct": 1}
+    monkeypatch.setattr(supervisor.retriever, "suggest_category", lambda query: "conduct")
+    assert supervisor._route(context) == "conduct"
+    monkeypatch.setattr(supervisor.retriever, "suggest_category", lambda query: "academic")
+    assert supervisor._route(context) == "facilities"